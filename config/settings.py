@@ -30,11 +30,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'habits.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'habits.sharding.ShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -66,9 +68,100 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # select_for_update() is a no-op on SQLite; taking the write
+            # lock at BEGIN is what serializes concurrent completions.
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'TEST': {
+            # A file, not shared-cache memory, so threaded tests wait on
+            # locks instead of failing with "table is locked".
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# Sharding, see habits/sharding.py
+# Each user's habits, completions, profile and rollups live on one of
+# these DATABASES aliases, picked round-robin when the user signs up and
+# recorded in UserShard; auth, sessions and admin stay on default. Empty
+# keeps everything on default. Every alias needs its own
+# `migrate --database`. Use rebalance_shards to move users after adding
+# a shard, or when turning sharding on for existing users. For example:
+#
+#     DATABASES['shard0'] = {**DATABASES['default'], 'NAME': BASE_DIR / 'shard0.sqlite3',
+#                            'TEST': {'NAME': BASE_DIR / 'test_shard0.sqlite3'}}
+#     HABIT_SHARDS = ['shard0', 'shard1']
+
+DATABASE_ROUTERS = ['habits.sharding.ShardRouter']
+
+HABIT_SHARDS = []
+
+# How long a cached user -> shard lookup is trusted. Only used with a
+# cache backend shared by every process (not locmem), so that moves are
+# seen everywhere; otherwise each lookup reads the UserShard directory.
+SHARD_CACHE_TIMEOUT = 60 * 5
+
+
+# Write-behind completions, see habits/writebehind.py
+# mark_complete only queues the tap and returns; `flush_completions
+# --loop` applies the queue in batches. A user's own queued taps are
+# applied before their dashboard is read.
+
+COMPLETION_WRITE_BEHIND = False
+
+
+# Applied to every new SQLite connection by habits/sqlite.py. WAL lets
+# readers run alongside the single writer, and with synchronous=NORMAL a
+# commit no longer waits for fsync (only a checkpoint does). Writers that
+# find the lock taken wait up to busy_timeout ms instead of failing with
+# "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -20000,  # KiB
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'habits',
     }
 }
 
+# Dashboard snapshots are keyed by a per-user version, so this is only a
+# memory bound, not a staleness bound.
+DASHBOARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+# Request profiling
+# Per-request SQL/template timing as Server-Timing headers and JSON log
+# lines on the habits.profiling logger, aggregated per view over the last
+# REQUEST_PROFILING_WINDOW seconds. Off by default; the middleware then
+# removes itself at startup.
+
+REQUEST_PROFILING = False
+REQUEST_PROFILING_WINDOW = 300
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'habits.profiling': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
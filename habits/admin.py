@@ -1,14 +1,66 @@
 from django.contrib import admin
-from .models import Habit, HabitCompletion
+from django.db import transaction
+from .bitmaps import rebuild_bitmaps
+from .load import rebuild_loads
+from .models import DailyLoad, Habit, HabitCompletion, UserDailyScore
+from .rollups import add_daily_scores, completion_totals, rebuild_daily_scores, remove_daily_scores
+from .sharding import current_db
+from .snapshots import bump_dashboard
+from .streaks import refresh_habit_stats
+
+
+def completions_changed(habit_ids, days):
+    habit_ids = set(habit_ids) - {None}
+    refresh_habit_stats(habit_ids)
+    rebuild_bitmaps(habit_ids)
+    user_ids = set(Habit.objects.filter(pk__in=habit_ids).values_list('user_id', flat=True))
+    days = set(days) - {None}
+    rebuild_daily_scores(user_ids, days=days)
+    rebuild_loads(user_ids, days)
+    bump_dashboard(*user_ids)
 
 
 @admin.register(Habit)
 class HabitAdmin(admin.ModelAdmin):
-    list_display = ('name', 'user', 'priority', 'weight', 'is_active')
-    list_filter = ('priority', 'is_active')
+    list_display = ('name', 'user', 'priority', 'difficulty', 'weight', 'score', 'load', 'momentum', 'is_active')
+    list_filter = ('priority', 'difficulty', 'is_active')
     search_fields = ('name',)
     ordering = ('-created_at',)
 
+    # The daily score rollups and the load ledger count the habit's
+    # completions for its user: moving or deleting it takes them off the
+    # days they were counted on, at what they were recorded as worth, and
+    # leaves every other day alone.
+    def save_model(self, request, obj, form, change):
+        previous = form.initial.get('user')
+        moved = change and previous != obj.user_id
+        with transaction.atomic(using=current_db()):
+            if moved:
+                days = completion_totals(HabitCompletion.objects.filter(habit=obj)).get(previous, {})
+            super().save_model(request, obj, form, change)
+            if moved:
+                remove_daily_scores({previous: days})
+                add_daily_scores(obj.user_id, days)
+                rebuild_loads([previous, obj.user_id], days)
+            bump_dashboard(obj.user_id, previous)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic(using=current_db()):
+            totals = completion_totals(HabitCompletion.objects.filter(habit=obj))
+            super().delete_model(request, obj)
+            remove_daily_scores(totals)
+            rebuild_loads(totals, {day for days in totals.values() for day in days})
+            bump_dashboard(obj.user_id)
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        with transaction.atomic(using=current_db()):
+            totals = completion_totals(HabitCompletion.objects.filter(habit__in=queryset))
+            super().delete_queryset(request, queryset)
+            remove_daily_scores(totals)
+            rebuild_loads(totals, {day for days in totals.values() for day in days})
+            bump_dashboard(*user_ids)
+
 
 @admin.register(HabitCompletion)
 class HabitCompletionAdmin(admin.ModelAdmin):
@@ -16,3 +68,40 @@ class HabitCompletionAdmin(admin.ModelAdmin):
     list_filter = ('date',)
     search_fields = ('habit__name',)
     ordering = ('-date',)
+
+    readonly_fields = ('score', 'load')
+
+    # Completions edited here bypass mark_complete, so rebuild the
+    # denormalized stats of every habit they touch, and the rollups of
+    # the days they were on. One added or moved to another habit counts
+    # at that habit's current worth.
+    def save_model(self, request, obj, form, change):
+        if not change or 'habit' in form.changed_data:
+            obj.score, obj.load = obj.habit.discipline_score(), obj.habit.load_cost()
+        super().save_model(request, obj, form, change)
+        completions_changed([obj.habit_id, form.initial.get('habit')], [obj.date, form.initial.get('date')])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        completions_changed([obj.habit_id], [obj.date])
+
+    def delete_queryset(self, request, queryset):
+        pairs = set(queryset.values_list('habit_id', 'date'))
+        super().delete_queryset(request, queryset)
+        completions_changed({habit_id for habit_id, _ in pairs}, {day for _, day in pairs})
+
+
+@admin.register(DailyLoad)
+class DailyLoadAdmin(admin.ModelAdmin):
+    list_display = ('user', 'date', 'load')
+    list_filter = ('date',)
+    search_fields = ('user__username',)
+    ordering = ('-date',)
+
+
+@admin.register(UserDailyScore)
+class UserDailyScoreAdmin(admin.ModelAdmin):
+    list_display = ('user', 'date', 'score', 'completions', 'load')
+    list_filter = ('date',)
+    search_fields = ('user__username',)
+    ordering = ('-date',)
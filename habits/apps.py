@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class HabitsConfig(AppConfig):
     name = 'habits'
+
+    def ready(self):
+        from . import sqlite  # noqa: F401  (connection_created hook)
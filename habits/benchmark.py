@@ -0,0 +1,352 @@
+import asyncio
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import close_old_connections, connection, connections, transaction
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .bitmaps import rebuild_bitmaps
+from .completions import complete_habit
+from .models import DEFAULT_DAILY_LOAD_CAP, Habit, HabitCompletion, UserProfile
+from .planner import plan_all, remaining_habits, solve
+from .rollups import rebuild_daily_scores
+from .sharding import allocate_habit_ids, move_user, shard_for
+from .snapshots import bump_dashboard
+from .streaks import refresh_habit_stats
+
+
+PASSWORD = "bench-password"
+
+
+def completion_days(rng, today, days):
+    # Two-state chain: a habit that was done yesterday is likely kept up,
+    # one that was missed takes a few days to pick back up. Reliability
+    # varies per habit, so the fixture has long streaks and long gaps.
+    keep = rng.betavariate(5, 2)
+    resume = rng.uniform(0.1, 0.6)
+
+    done = rng.random() < 0.5
+    for offset in range(days, 0, -1):
+        done = rng.random() < (keep if done else resume)
+        if done:
+            yield today - timedelta(days=offset)
+
+
+def generate_fixtures(users, habits, days, today, seed=0):
+    rng = random.Random(seed)
+    difficulties = [choice for choice, _ in Habit.DIFFICULTY_CHOICES]
+    priorities = [choice for choice, _ in Habit.PRIORITY_CHOICES]
+
+    user_ids = []
+    for u in range(users):
+        with transaction.atomic():
+            user = User.objects.create_user(f"bench{u}", password=PASSWORD)
+            # Measure the views, not the cap: every completion is accepted
+            UserProfile.objects.filter(user=user).update(daily_load_cap=10 ** 6)
+
+            created = Habit.objects.bulk_create([
+                Habit(
+                    pk=pk,
+                    user=user,
+                    name=f"habit {h}",
+                    weight=rng.randint(1, 5),
+                    difficulty=rng.choice(difficulties),
+                    priority=rng.choice(priorities),
+                )
+                for h, pk in enumerate(allocate_habit_ids(habits))
+            ])
+
+            HabitCompletion.objects.bulk_create(
+                [
+                    HabitCompletion(
+                        habit=habit, date=day, score=habit.discipline_score(), load=habit.load_cost()
+                    )
+                    for habit in created
+                    for day in completion_days(rng, today, days)
+                ],
+                batch_size=2000,
+            )
+
+            habit_ids = [habit.pk for habit in created]
+            refresh_habit_stats(habit_ids, today)
+            rebuild_bitmaps(habit_ids)
+            rebuild_daily_scores([user.pk])
+
+        user_ids.append(user.pk)
+
+    return user_ids
+
+
+def measure(call, repeat):
+    timings, queries = [], []
+
+    tracemalloc.start()
+    for i in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            call(i)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "runs": repeat,
+        "queries": max(queries),
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(user_ids, repeat):
+    user = User.objects.get(pk=user_ids[0])
+    habits = list(Habit.objects.filter(user=user).order_by("pk"))
+
+    client = Client()
+    client.login(username=user.username, password=PASSWORD)
+    dashboard = reverse("dashboard")
+
+    def cold_dashboard(i):
+        bump_dashboard(user.pk)
+        client.get(dashboard)
+
+    def warm_dashboard(i):
+        client.get(dashboard)
+
+    def complete(i):
+        # A different habit each run, so every tap is a first completion
+        client.get(reverse("habit_complete", args=[habits[i % len(habits)].pk]))
+
+    def cold_plan(i):
+        bump_dashboard(user.pk)
+        client.get(reverse("plan_api"))
+
+    def update(i):
+        habit = habits[i % len(habits)]
+        client.post(
+            reverse("habit_update", args=[habit.pk]),
+            {"name": habit.name, "weight": habit.weight % 5 + 1},
+        )
+
+    results = {"dashboard": measure(cold_dashboard, repeat)}
+
+    client.get(dashboard)
+    results["dashboard_cached"] = measure(warm_dashboard, repeat)
+
+    results["mark_complete"] = measure(complete, min(repeat, len(habits)))
+    results["plan"] = measure(cold_plan, repeat)
+    results["habit_update"] = measure(update, repeat)
+    return results
+
+
+def planner_timing(user_ids, today, repeat):
+    # The knapsack alone per user, rows already in memory, and plan_all()
+    # over every fixture user, queries included, per plan. The fixture cap
+    # lets everything through, which needs no solving: plan against the
+    # default cap instead, and put the fixture's back afterwards.
+    profiles = list(UserProfile.objects.filter(user_id__in=user_ids).only("pk", "daily_load_cap"))
+    UserProfile.objects.filter(user_id__in=user_ids).update(daily_load_cap=DEFAULT_DAILY_LOAD_CAP)
+
+    try:
+        rows = {}
+        for row in remaining_habits(Habit.objects.filter(user_id__in=user_ids), today):
+            rows.setdefault(row[1], []).append(row)
+
+        timings = []
+        for _ in range(repeat):
+            for user_id in user_ids:
+                started = time.perf_counter()
+                solve(rows.get(user_id, []), DEFAULT_DAILY_LOAD_CAP, today)
+                timings.append((time.perf_counter() - started) * 10 ** 6)
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            plan_all(today)
+        batch = time.perf_counter() - started
+    finally:
+        UserProfile.objects.bulk_update(profiles, ["daily_load_cap"])
+
+    timings.sort()
+    return {
+        "plans": len(timings),
+        "solve_p50_us": round(statistics.median(timings), 1),
+        "solve_p95_us": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 1),
+        "batch_us_per_plan": round(batch / (repeat * len(user_ids)) * 10 ** 6, 1),
+    }
+
+
+def throughput(user_ids, requests, concurrency):
+    # The same dashboard requests through Django's WSGI handler on a thread
+    # pool and through its ASGI handler on one event loop, in-process.
+    user = User.objects.get(pk=user_ids[0])
+    client = Client()
+    client.login(username=user.username, password=PASSWORD)
+    dashboard = reverse("dashboard")
+
+    def wsgi_worker(count):
+        worker = Client()
+        worker.cookies = client.cookies
+        try:
+            for _ in range(count):
+                worker.get(dashboard)
+        finally:
+            close_old_connections()
+
+    started = time.perf_counter()
+    per_worker = [requests // concurrency] * concurrency
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(wsgi_worker, per_worker))
+    wsgi = time.perf_counter() - started
+
+    async def asgi_run():
+        aclient = AsyncClient()
+        aclient.cookies = client.cookies
+        slots = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with slots:
+                await aclient.get(dashboard)
+
+        await asyncio.gather(*[one() for _ in range(sum(per_worker))])
+
+    started = time.perf_counter()
+    asyncio.run(asgi_run())
+    asgi = time.perf_counter() - started
+
+    return {
+        "requests": sum(per_worker),
+        "concurrency": concurrency,
+        "wsgi_rps": round(sum(per_worker) / wsgi, 1),
+        "asgi_rps": round(sum(per_worker) / asgi, 1),
+    }
+
+
+# SQLite's own defaults, to compare SQLITE_PRAGMAS against
+DEFAULT_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL"}
+
+
+def write_throughput(user_ids, writes, concurrency, today):
+    # Concurrent complete_habit() calls under SQLite's default pragmas and
+    # under settings.SQLITE_PRAGMAS. Every call is a first completion (a
+    # fresh future day per habit), so each one really writes.
+    user = User.objects.get(pk=user_ids[0])
+    habit_ids = list(Habit.objects.filter(user=user).values_list("pk", flat=True))
+
+    def run(pragmas, first_day):
+        tasks = [
+            (habit_ids[i % len(habit_ids)], first_day + timedelta(days=i // len(habit_ids)))
+            for i in range(writes)
+        ]
+
+        def worker(chunk):
+            try:
+                for habit_id, day in chunk:
+                    complete_habit(user, habit_id, day, daily_load_cap=10 ** 6)
+            finally:
+                connection.close()
+
+        # Pragmas are applied per connection, so start from none open. The
+        # journal mode is stored in the file: switch it once, up front.
+        connection.close()
+        with override_settings(SQLITE_PRAGMAS=pragmas):
+            connection.ensure_connection()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(worker, [tasks[i::concurrency] for i in range(concurrency)]))
+            elapsed = time.perf_counter() - started
+        connection.close()
+
+        return round(writes / elapsed, 1)
+
+    return {
+        "writes": writes,
+        "concurrency": concurrency,
+        "default_wps": run(DEFAULT_PRAGMAS, today + timedelta(days=1)),
+        "tuned_wps": run(settings.SQLITE_PRAGMAS, today + timedelta(days=1 + writes)),
+    }
+
+
+@contextmanager
+def temporary_shards(count):
+    # count migrated SQLite databases, configured like default, that exist
+    # only inside the block
+    directory = tempfile.mkdtemp(prefix="habits-shards-")
+    aliases = [f"bench_shard{i}" for i in range(count)]
+    for alias in aliases:
+        connections.settings[alias] = {
+            **connections.settings["default"], "NAME": str(Path(directory) / f"{alias}.sqlite3"),
+        }
+
+    try:
+        with override_settings(HABIT_SHARDS=aliases):
+            for alias in aliases:
+                call_command("migrate", database=alias, verbosity=0)
+        yield aliases
+    finally:
+        for alias in aliases:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        shutil.rmtree(directory)
+
+
+def shard_throughput(user_ids, writes, concurrency, today, max_shards):
+    # The same concurrent complete_habit() calls, spread over every user,
+    # with the users moved onto 1, 2, ... max_shards databases. Each
+    # database has its own write lock, so more shards let more writers
+    # commit at once. Leaves the users on the temporary shards: run last.
+    users = list(User.objects.filter(pk__in=user_ids).order_by("pk"))
+    first_day = today + timedelta(days=1)
+    rates = {}
+
+    with temporary_shards(max_shards) as aliases:
+        for count in range(1, max_shards + 1):
+            with override_settings(HABIT_SHARDS=aliases[:count]):
+                for i, user in enumerate(users):
+                    move_user(user.pk, aliases[i % count])
+
+                # A fresh day per round keeps every call a first completion
+                habits = [
+                    (user, pk)
+                    for user in users
+                    for pk in (
+                        Habit.objects.using(shard_for(user.pk))
+                        .filter(user=user)
+                        .values_list("pk", flat=True)
+                    )
+                ]
+                tasks = [
+                    (*habits[i % len(habits)], first_day + timedelta(days=i // len(habits)))
+                    for i in range(writes)
+                ]
+                first_day += timedelta(days=writes)
+
+                def worker(chunk):
+                    try:
+                        for user, habit_id, day in chunk:
+                            complete_habit(user, habit_id, day, daily_load_cap=10 ** 6)
+                    finally:
+                        for alias in ["default", *aliases]:
+                            connections[alias].close()
+
+                started = time.perf_counter()
+                with ThreadPoolExecutor(concurrency) as pool:
+                    list(pool.map(worker, [tasks[i::concurrency] for i in range(concurrency)]))
+                rates[count] = round(writes / (time.perf_counter() - started), 1)
+
+    return {"writes": writes, "concurrency": concurrency, "wps": rates}
@@ -0,0 +1,112 @@
+from collections import defaultdict
+from datetime import date
+
+
+# One bit per day of the year, bit 0 = January 1st: 366 bits, 46 bytes.
+YEAR_BYTES = 46
+
+
+def day_bit(day):
+    return day.toordinal() - date(day.year, 1, 1).toordinal()
+
+
+def group_by_year(habit_days):
+    groups = defaultdict(set)
+    for habit_id, day in habit_days:
+        groups[(habit_id, day.year)].add(day_bit(day))
+    return groups
+
+
+def set_bits(bits, positions):
+    bits = bytearray(bits or bytes(YEAR_BYTES))
+    for pos in positions:
+        bits[pos >> 3] |= 1 << (pos & 7)
+    return bytes(bits)
+
+
+def mark_days(habit_days):
+    from .models import CompletionBitmap
+
+    groups = group_by_year(habit_days)
+    if not groups:
+        return
+
+    existing = {
+        (row.habit_id, row.year): row
+        for row in CompletionBitmap.objects.select_for_update().filter(
+            habit_id__in={habit_id for habit_id, _ in groups},
+            year__in={year for _, year in groups},
+        )
+    }
+
+    changed, created = [], []
+    for key, positions in groups.items():
+        row = existing.get(key)
+        if row is None:
+            created.append(CompletionBitmap(
+                habit_id=key[0], year=key[1], bits=set_bits(None, positions)
+            ))
+        else:
+            row.bits = set_bits(bytes(row.bits), positions)
+            changed.append(row)
+
+    CompletionBitmap.objects.bulk_create(created)
+    CompletionBitmap.objects.bulk_update(changed, ["bits"])
+
+
+def rebuild_bitmaps(habit_ids):
+    from .models import CompletionBitmap, HabitCompletion
+
+    habit_ids = list(habit_ids)
+    rows = (
+        HabitCompletion.objects
+        .filter(habit_id__in=habit_ids)
+        .values_list("habit_id", "date")
+    )
+    groups = group_by_year(rows.iterator())
+
+    CompletionBitmap.objects.filter(habit_id__in=habit_ids).delete()
+    CompletionBitmap.objects.bulk_create(
+        [
+            CompletionBitmap(habit_id=habit_id, year=year, bits=set_bits(None, positions))
+            for (habit_id, year), positions in groups.items()
+        ],
+        batch_size=500,
+    )
+
+
+class CompletionHistory:
+    # A habit's loaded years as one Python int, bit n = n days after
+    # January 1st of the earliest loaded year.
+
+    def __init__(self):
+        self.mask = 0
+        self.base = None
+
+    def add_year(self, year, bits):
+        start = date(year, 1, 1).toordinal()
+        if self.base is None:
+            self.base = start
+        elif start < self.base:
+            self.mask <<= self.base - start
+            self.base = start
+        self.mask |= int.from_bytes(bytes(bits), "little") << (start - self.base)
+
+    def done(self, day):
+        pos = day.toordinal() - (self.base or 0)
+        return pos >= 0 and bool(self.mask >> pos & 1)
+
+
+def load_histories(habits, year=None):
+    # Every year of history for the given habits queryset, or only the
+    # given year, in one query
+    from .models import CompletionBitmap
+
+    rows = CompletionBitmap.objects.filter(habit__in=habits)
+    if year is not None:
+        rows = rows.filter(year=year)
+
+    histories = defaultdict(CompletionHistory)
+    for habit_id, year, bits in rows.values_list("habit_id", "year", "bits"):
+        histories[habit_id].add_year(year, bits)
+    return histories
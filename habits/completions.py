@@ -0,0 +1,218 @@
+from collections import defaultdict
+from datetime import date
+
+from django.db import transaction
+
+from .bitmaps import mark_days
+from .load import add_loads, charge_load
+from .models import DailyLoad, Habit, HabitCompletion
+from .rollups import add_daily_scores
+from .sharding import user_shard
+from .snapshots import bump_dashboard
+from .streaks import STATS_FIELDS, apply_stats, streak_stats
+
+
+SYNC_BATCH_LIMIT = 1000
+
+COMPLETED = "completed"
+DUPLICATE = "duplicate"
+OVER_CAP = "over_cap"
+
+
+def complete_habit(user, habit_id, day, daily_load_cap):
+    # One transaction, and at most one write per table: the completion
+    # insert, the load charge and a single UPDATE of the locked habit row.
+    with user_shard(user.pk) as db, transaction.atomic(using=db):
+        habit = Habit.objects.select_for_update().get(pk=habit_id, user=user)
+
+        with transaction.atomic(using=db):
+            score, cost = habit.discipline_score(), habit.load_cost()
+            _, created = HabitCompletion.objects.get_or_create(
+                habit=habit, date=day, defaults={"score": score, "load": cost}
+            )
+            over_cap = created and not charge_load(user, day, cost, daily_load_cap)
+            if over_cap:
+                # Undo the completion insert, the load was never charged
+                transaction.set_rollback(True, using=db)
+
+        # Too much load → decay instead of reward
+        fields = set(habit.decay_momentum(day, commit=False))
+
+        if created and not over_cap:
+            mark_days([(habit.pk, day)])
+            add_daily_scores(user.pk, {day: (score, 1, cost)})
+            fields.update(habit.record_completion(day, commit=False))
+            fields.update(habit.gain_momentum(day, commit=False))
+            fields.update(habit.auto_tune_difficulty(commit=False))
+
+        if fields:
+            habit.save(update_fields=fields)
+            bump_dashboard(user.pk)
+
+    if over_cap:
+        return OVER_CAP
+    return COMPLETED if created else DUPLICATE
+
+
+class BadSyncItem(ValueError):
+    pass
+
+
+def parse_sync_items(items, today):
+    # An item of the wrong shape means a broken client and fails the whole
+    # request; a well-formed item that cannot be applied is reported back.
+    # Habit ids must be JSON integers: int() would also take true or 1.9.
+    pairs, rejected = set(), []
+
+    for index, item in enumerate(items):
+        if (
+            not isinstance(item, dict)
+            or type(item.get("habit")) is not int
+            or not isinstance(item.get("date"), str)
+        ):
+            raise BadSyncItem(f"completions[{index}] must be {{\"habit\": int, \"date\": \"YYYY-MM-DD\"}}")
+
+        habit_id = item["habit"]
+        try:
+            day = date.fromisoformat(item["date"])
+        except ValueError:
+            rejected.append({"index": index, "reason": "invalid"})
+            continue
+
+        if day > today:
+            rejected.append({"index": index, "reason": "future_date"})
+            continue
+
+        pairs.add((habit_id, day))
+
+    return pairs, rejected
+
+
+def apply_synced_completions(user, pairs, today):
+    # Completions recorded offline already happened, so they are added to
+    # the load ledger but never rejected by the daily cap.
+    with user_shard(user.pk) as db, transaction.atomic(using=db):
+        habits = Habit.objects.select_for_update().filter(user=user).in_bulk(
+            {habit_id for habit_id, _ in pairs}
+        )
+        unknown = {habit_id for habit_id, _ in pairs} - habits.keys()
+        pairs = {(habit_id, day) for habit_id, day in pairs if habit_id in habits}
+
+        existing = set(
+            HabitCompletion.objects
+            .filter(habit_id__in=habits, date__in={day for _, day in pairs})
+            .values_list("habit_id", "date")
+        )
+        new = sorted(pairs - existing, key=lambda pair: pair[1])
+
+        # Replay the same rules as mark_complete, oldest day first
+        fields = set()
+        completions = []
+        loads = defaultdict(int)
+        scores = defaultdict(lambda: [0.0, 0, 0])
+        for habit_id, day in new:
+            habit = habits[habit_id]
+            score, cost = habit.discipline_score(), habit.load_cost()
+            completions.append(HabitCompletion(habit_id=habit_id, date=day, score=score, load=cost))
+            loads[day] += cost
+            scores[day][0] += score
+            scores[day][1] += 1
+            scores[day][2] += cost
+            fields.update(habit.decay_momentum(day, commit=False))
+            fields.update(habit.gain_momentum(day, commit=False))
+            fields.update(habit.auto_tune_difficulty(commit=False))
+
+        HabitCompletion.objects.bulk_create(completions, ignore_conflicts=True)
+        mark_days(new)
+
+        touched = [habits[pk] for pk in {habit_id for habit_id, _ in new}]
+        if touched:
+            stats = streak_stats([habit.pk for habit in touched], today)
+            for habit in touched:
+                apply_stats(habit, stats[habit.pk])
+
+            Habit.objects.bulk_update(touched, fields | set(STATS_FIELDS))
+
+            add_loads(user, loads)
+            add_daily_scores(user.pk, scores)
+
+            bump_dashboard(user.pk)
+
+    return {
+        "created": len(new),
+        "duplicates": len(pairs) - len(new),
+        "unknown_habits": sorted(unknown),
+    }
+
+
+def apply_queued_completions(user, pairs, daily_load_cap):
+    # Queued mark_complete taps, in the order they were made, under the
+    # same rules as complete_habit(): duplicates and over-cap taps only
+    # decay. One insert for every accepted completion and one UPDATE per
+    # habit. The caller holds the transaction on the user's shard.
+    habits = Habit.objects.select_for_update().filter(user=user).in_bulk(
+        {habit_id for habit_id, _ in pairs}
+    )
+    days = {day for _, day in pairs}
+    done = set(
+        HabitCompletion.objects
+        .filter(habit_id__in=habits, date__in=days)
+        .values_list("habit_id", "date")
+    )
+    charged = dict(
+        DailyLoad.objects.filter(user=user, date__in=days).values_list("date", "load")
+    )
+
+    new = []
+    completions = []
+    fields = set()
+    touched = set()
+    loads = defaultdict(int)
+    scores = defaultdict(lambda: [0.0, 0, 0])
+    for habit_id, day in pairs:
+        habit = habits.get(habit_id)
+        if habit is None:
+            continue
+
+        changed = set(habit.decay_momentum(day, commit=False))
+        # The cost follows the difficulty retuned by earlier taps
+        cost = habit.load_cost()
+        if (habit_id, day) not in done and charged.get(day, 0) + loads[day] + cost <= daily_load_cap:
+            score = habit.discipline_score()
+            done.add((habit_id, day))
+            new.append((habit_id, day))
+            completions.append(HabitCompletion(habit_id=habit_id, date=day, score=score, load=cost))
+            loads[day] += cost
+            scores[day][0] += score
+            scores[day][1] += 1
+            scores[day][2] += cost
+            changed.update(habit.gain_momentum(day, commit=False))
+            changed.update(habit.auto_tune_difficulty(commit=False))
+
+        if changed:
+            fields |= changed
+            touched.add(habit_id)
+
+    HabitCompletion.objects.bulk_create(completions)
+    mark_days(new)
+
+    if new:
+        # Streak columns from the stored history, backfilled days included
+        completed = {habit_id for habit_id, _ in new}
+        latest = max(
+            [day for _, day in new]
+            + [habits[pk].last_completed for pk in completed if habits[pk].last_completed]
+        )
+        stats = streak_stats(completed, latest)
+        for habit_id in completed:
+            apply_stats(habits[habit_id], stats[habit_id])
+        fields.update(STATS_FIELDS)
+        touched |= completed
+
+    if touched:
+        Habit.objects.bulk_update([habits[pk] for pk in touched], fields)
+        add_loads(user, loads)
+        add_daily_scores(user.pk, scores)
+        bump_dashboard(user.pk)
+
+    return len(new)
@@ -0,0 +1,47 @@
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db.models import Count, F, FilteredRelation, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+# done/possible are days within the window, counted from the later of
+# the window start and the day the habit was created.
+Consistency = namedtuple("Consistency", ["done", "possible"])
+
+
+def percent(done, possible):
+    return round(done / possible * 100, 1) if possible else 0
+
+
+def habit_consistency(habits, today=None, days=30):
+    # One grouped aggregate over the given habits queryset
+    today = today or timezone.now().date()
+    start = today - timedelta(days=days - 1)
+
+    rows = (
+        habits
+        .filter(is_active=True)
+        # The window is part of the join, so only its rows are read from
+        # the (habit, date) index rather than the habit's whole history
+        .annotate(window=FilteredRelation(
+            "completions",
+            condition=Q(completions__date__range=(start, today)),
+        ))
+        .annotate(done=Count("window", filter=Q(window__date__gte=TruncDate(F("created_at")))))
+        .values_list("pk", "created_at", "done")
+    )
+
+    stats = {}
+    for pk, created_at, done in rows:
+        possible = (today - max(start, timezone.localdate(created_at))).days + 1
+        if possible > 0:
+            stats[pk] = Consistency(done, possible)
+    return stats
+
+
+def user_consistency(habits, today=None, days=30):
+    # Pooled over days, so a habit added last week weighs a week, not a month
+    stats = habit_consistency(habits, today, days).values()
+    return percent(sum(s.done for s in stats), sum(s.possible for s in stats))
@@ -0,0 +1,96 @@
+import asyncio
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Sum
+
+from .bitmaps import load_histories
+from .consistency import user_consistency
+from .models import Habit
+from .rollups import score_range
+from .scoring import BURNOUT
+
+
+def habit_row(habit):
+    return {
+        "id": habit.id,
+        "name": habit.name,
+        "difficulty": habit.get_difficulty_display(),
+        "priority": habit.get_priority_display(),
+        "momentum": round(habit.momentum, 2),
+        "current_streak": habit.current_streak(),
+        "missed_days": habit.missed_days(),
+        "last_completed": habit.last_completed_date(),
+        "streak_percentage": habit.streak_percentage(),
+    }
+
+
+def build_dashboard(user, today):
+    habits = Habit.objects.filter(user=user)
+
+    return assemble_dashboard(
+        today,
+        list(habits.filter(is_active=True)),
+        # Only completed_today reads the bitmaps: this year's, active habits
+        load_histories(habits.filter(is_active=True), today.year),
+        habits.filter(is_active=True).aggregate(**TOTALS),
+        score_range(user, today - timedelta(days=6), today),
+        user_consistency(habits, today, days=30),
+    )
+
+
+async def abuild_dashboard(user, today):
+    # The same independent queries, awaited together. The async ORM runs
+    # them on Django's shared sync thread, so the gain is not blocking
+    # the event loop rather than parallel SQL.
+    habits = Habit.objects.filter(user=user)
+
+    parts = await asyncio.gather(
+        _alist(habits.filter(is_active=True)),
+        sync_to_async(load_histories)(habits.filter(is_active=True), today.year),
+        habits.filter(is_active=True).aaggregate(**TOTALS),
+        sync_to_async(score_range)(user, today - timedelta(days=6), today),
+        sync_to_async(user_consistency)(habits, today, days=30),
+    )
+    return assemble_dashboard(today, *parts)
+
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
+
+# Total discipline score and burnout, summed by the database
+TOTALS = {
+    "score": Sum("score", default=0),
+    "burnout": Count("pk", filter=BURNOUT),
+}
+
+
+def assemble_dashboard(today, habits, histories, totals, scores, consistency):
+    completed_today = {
+        habit.id for habit in habits if histories[habit.id].done(today)
+    }
+
+    # ---- Daily scores, read from the rollup ----
+    daily_scores = [
+        {"date": day.strftime("%b %d"), "score": score}
+        for day, score in scores
+    ]
+
+    # ---- Trend ----
+    trend = "stable"
+    if daily_scores[-1]["score"] > daily_scores[0]["score"]:
+        trend = "improving"
+    elif daily_scores[-1]["score"] < daily_scores[0]["score"]:
+        trend = "declining"
+
+    # Plain data only: the whole dict is pickled into the snapshot cache
+    return {
+        "habits": [habit_row(habit) for habit in habits],
+        "completed_habits": completed_today,
+        "daily_scores": daily_scores,
+        "total_score": int(totals["score"]),
+        "trend": trend,
+        "has_burnout_risk": totals["burnout"] > 0,
+        "consistency_score": int(consistency),
+    }
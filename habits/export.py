@@ -0,0 +1,116 @@
+import csv
+import json
+from datetime import timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+
+from .models import HabitCompletion
+from .momentum import MomentumReplay
+
+
+CHUNK_SIZE = 2000
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+COLUMNS = ["user", "habit_id", "habit", "identity", "date"]
+DERIVED_COLUMNS = ["streak", "momentum"]
+
+
+def completion_rows(habits, start=None, end=None, derived=False):
+    # One pass over the given habits queryset and, alongside it, one over
+    # their completions, both ordered by habit (then date) and read in
+    # chunks, so memory stays flat. A habit with no completions in the
+    # range still gets one row, with the date (and derived columns) empty,
+    # so an export/import round trip keeps it. Usernames come from the
+    # default database, the habits may be on a shard.
+    usernames = dict(
+        User.objects
+        .filter(pk__in=set(habits.values_list("user_id", flat=True)))
+        .values_list("pk", "username")
+    )
+    completions = HabitCompletion.objects.using(habits.db).filter(habit__in=habits)
+    if end:
+        completions = completions.filter(date__lte=end)
+    if start and not derived:
+        # Derived columns depend on everything before the range
+        completions = completions.filter(date__gte=start)
+
+    days = (
+        completions
+        .order_by("habit_id", "date")
+        .values_list("habit_id", "date")
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    pending = next(days, None)
+
+    for user_id, pk, name, identity, weight, priority in (
+        habits
+        .order_by("pk")
+        .values_list("user_id", "pk", "name", "identity", "weight", "priority")
+        .iterator(chunk_size=CHUNK_SIZE)
+    ):
+        habit = (usernames[user_id], pk, name, identity)
+        prev, streak = None, 0
+        replay = MomentumReplay(weight=weight, priority=priority) if derived else None
+        emitted = False
+
+        while pending is not None and pending[0] == pk:
+            day = pending[1]
+            pending = next(days, None)
+            if not derived:
+                yield (*habit, day)
+                emitted = True
+                continue
+
+            streak = streak + 1 if prev == day - timedelta(days=1) else 1
+            prev = day
+            momentum = replay.complete(day)
+            if start is None or day >= start:
+                yield (*habit, day, streak, round(momentum, 3))
+                emitted = True
+
+        if not emitted:
+            yield (*habit, None, *([None] * len(DERIVED_COLUMNS) if derived else []))
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, derived=False, header=True):
+    writer = csv.writer(_Echo())
+    if header:
+        yield writer.writerow(COLUMNS + (DERIVED_COLUMNS if derived else []))
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows, derived=False):
+    columns = COLUMNS + (DERIVED_COLUMNS if derived else [])
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), default=str) + "\n"
+
+
+async def aexport_lines(lines, batch=CHUNK_SIZE):
+    # For ASGI, which serves a sync iterator only by buffering all of it:
+    # batches of lines are pulled on the one sync thread, where the
+    # queries' cursors live
+    next_batch = sync_to_async(lambda: list(islice(lines, batch)))
+    while chunk := await next_batch():
+        for line in chunk:
+            yield line
+
+
+def export_lines(habits, fmt, start=None, end=None, derived=False, header=True):
+    # The lines are produced after the caller returns (e.g. streamed by
+    # the response), so the habits' database is fixed now.
+    rows = completion_rows(habits.using(habits.db), start, end, derived)
+    if fmt == "csv":
+        return csv_lines(rows, derived, header)
+    return ndjson_lines(rows, derived)
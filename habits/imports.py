@@ -0,0 +1,199 @@
+import csv
+import json
+from collections import defaultdict
+from datetime import date, datetime, time
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .bitmaps import rebuild_bitmaps
+from .models import Habit, HabitCompletion
+from .momentum import replay_habits
+from .rollups import add_daily_scores
+from .sharding import by_shard, use_shard, user_shard
+from .snapshots import bump_dashboard
+from .streaks import refresh_habit_stats
+
+
+BATCH_SIZE = 5000
+STATS_CHUNK = 1000
+
+# Weight given to habits the import has to create; the file only names them
+DEFAULT_WEIGHT = 3
+
+
+class BadRow(ValueError):
+    pass
+
+
+def read_rows(f, fmt):
+    # Yields dicts lazily, so the file is never held in memory. Accepts the
+    # columns written by export.py; only habit and date are required. A
+    # line that is not JSON is yielded as a BadRow, to be skipped with the
+    # other bad rows instead of ending the import.
+    if fmt == "csv":
+        yield from csv.DictReader(f)
+    else:
+        for line in f:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield BadRow(f"bad line {line.strip()!r}: {e}")
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def backdate_habits(habit_ids):
+    # A habit dates from its earliest completion at the latest: one the
+    # import created would otherwise start today, and habit_consistency()
+    # leaves out every day before created_at.
+    habits = Habit.objects.only("pk", "created_at").in_bulk(habit_ids)
+    firsts = (
+        HabitCompletion.objects
+        .filter(habit_id__in=habit_ids)
+        .values_list("habit_id")
+        .annotate(first=Min("date"))
+        .order_by()
+    )
+
+    changed = []
+    for habit_id, first in firsts:
+        habit = habits[habit_id]
+        if first < timezone.localdate(habit.created_at):
+            habit.created_at = timezone.make_aware(datetime.combine(first, time.min))
+            changed.append(habit)
+    Habit.objects.bulk_update(changed, ["created_at"], batch_size=500)
+
+
+class HistoryImporter:
+    # Habits and users are looked up once and remembered by name, so memory
+    # grows with the number of habits, not the number of rows.
+
+    def __init__(self, username=None, batch_size=BATCH_SIZE):
+        self.username = username
+        self.batch_size = batch_size
+        self.users = {}
+        self.habits = {}
+        # habit pk: (score, load) its imported completions are recorded at
+        self.worth = {}
+        # rows read, skipped as bad, naming only a habit, and completions
+        # actually inserted; the rest were already in the database or
+        # repeated in the file
+        self.rows = self.skipped = self.bare = self.imported = 0
+
+    def user_id(self, username):
+        if username not in self.users:
+            pk = User.objects.filter(username=username).values_list("pk", flat=True).first()
+            if pk is None:
+                raise BadRow(f"unknown user {username!r}")
+            self.users[username] = pk
+        return self.users[username]
+
+    def habit_id(self, user_id, name, identity):
+        key = (user_id, name)
+        if key not in self.habits:
+            with user_shard(user_id):
+                habit = Habit.objects.filter(user_id=user_id, name=name).order_by("pk").first()
+                if habit is None:
+                    habit = Habit.objects.create(
+                        user_id=user_id,
+                        name=name,
+                        identity=identity or "discipline",
+                        weight=DEFAULT_WEIGHT,
+                    )
+            self.habits[key] = habit.pk
+            self.worth[habit.pk] = (habit.discipline_score(), habit.load_cost())
+        return self.habits[key]
+
+    def completion(self, row):
+        if isinstance(row, BadRow):
+            raise row
+        if not isinstance(row, dict):
+            raise BadRow(f"bad row {row!r}")
+        try:
+            username = self.username or row["user"]
+            name = row["habit"].strip()
+            day = row["date"]
+            # Blank for a habit exported without completions
+            day = date.fromisoformat(str(day)) if day not in (None, "") else None
+        except (KeyError, AttributeError, ValueError) as e:
+            raise BadRow(f"bad row {row!r}") from e
+        if not name:
+            raise BadRow(f"bad row {row!r}")
+
+        user_id = self.user_id(username)
+        habit_id = self.habit_id(user_id, name, row.get("identity"))
+        if day is None:
+            return user_id, None
+        score, cost = self.worth[habit_id]
+        return user_id, HabitCompletion(habit_id=habit_id, date=day, score=score, load=cost)
+
+    def load(self, rows):
+        for batch in batches(rows, self.batch_size):
+            completions = {}
+            for row in batch:
+                try:
+                    user_id, completion = self.completion(row)
+                except BadRow:
+                    self.skipped += 1
+                else:
+                    if completion is None:
+                        self.bare += 1
+                    else:
+                        completions.setdefault(user_id, []).append(completion)
+
+            # One transaction per shard the batch touches. Completions
+            # already stored are left out, so only real inserts are counted.
+            for db, user_ids in by_shard(completions).items():
+                new = {
+                    (c.habit_id, c.date): c
+                    for user_id in user_ids for c in completions[user_id]
+                }
+                with transaction.atomic(using=db):
+                    existing = HabitCompletion.objects.using(db).filter(
+                        habit_id__in={habit_id for habit_id, _ in new},
+                        date__in={day for _, day in new},
+                    ).values_list("habit_id", "date")
+                    for key in existing:
+                        new.pop(key, None)
+
+                    HabitCompletion.objects.using(db).bulk_create(
+                        new.values(), batch_size=1000, ignore_conflicts=True
+                    )
+                    # Only the imported days change in the rollups
+                    with use_shard(db):
+                        for user_id in user_ids:
+                            days = defaultdict(lambda: [0.0, 0, 0])
+                            for c in completions[user_id]:
+                                if new.get((c.habit_id, c.date)) is c:
+                                    days[c.date][0] += c.score
+                                    days[c.date][1] += 1
+                                    days[c.date][2] += c.load
+                            add_daily_scores(user_id, days)
+                self.imported += len(new)
+            self.rows += len(batch)
+
+    def finish(self):
+        # Everything derived from history is rebuilt once, per habit
+        for db, user_ids in by_shard(self.users.values()).items():
+            shard_users = set(user_ids)
+            habit_ids = sorted(
+                pk for (user_id, _), pk in self.habits.items() if user_id in shard_users
+            )
+
+            with use_shard(db):
+                for start in range(0, len(habit_ids), STATS_CHUNK):
+                    with transaction.atomic(using=db):
+                        refresh_habit_stats(habit_ids[start:start + STATS_CHUNK])
+                        rebuild_bitmaps(habit_ids[start:start + STATS_CHUNK])
+                        backdate_habits(habit_ids[start:start + STATS_CHUNK])
+                replay_habits(habit_ids)
+                bump_dashboard(*user_ids)
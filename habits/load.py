@@ -0,0 +1,93 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Sum, Value, When
+
+from .models import DEFAULT_DAILY_LOAD_CAP, DailyLoad, HabitCompletion, UserProfile
+from .sharding import current_db
+
+
+def load_cap(user):
+    cap = (
+        UserProfile.objects
+        .filter(user=user)
+        .values_list("daily_load_cap", flat=True)
+        .first()
+    )
+    return DEFAULT_DAILY_LOAD_CAP if cap is None else cap
+
+
+def today_load(user, day):
+    load = (
+        DailyLoad.objects
+        .filter(user=user, date=day)
+        .values_list("load", flat=True)
+        .first()
+    )
+    return load or 0
+
+
+def charge_load(user, day, cost, cap):
+    # Check and increment in one UPDATE: the WHERE clause is evaluated
+    # against the row under the write lock, so two concurrent charges can
+    # never both squeeze under the cap.
+    def increment():
+        return (
+            DailyLoad.objects
+            .filter(user=user, date=day, load__lte=cap - cost)
+            .update(load=F("load") + cost)
+        ) == 1
+
+    if increment():
+        return True
+    if cost > cap or DailyLoad.objects.filter(user=user, date=day).exists():
+        return False
+
+    # First charge of the day
+    try:
+        with transaction.atomic(using=current_db()):
+            DailyLoad.objects.create(user=user, date=day, load=cost)
+        return True
+    except IntegrityError:
+        # Lost the race to create the row, charge the winner's row instead
+        return increment()
+
+
+def add_loads(user, loads):
+    # Uncapped charges for completions that already happened elsewhere,
+    # {date: cost}. Rows are created empty first so a single CASE update
+    # can increment every day at once.
+    if not loads:
+        return
+
+    DailyLoad.objects.bulk_create(
+        [DailyLoad(user=user, date=day) for day in loads],
+        ignore_conflicts=True,
+    )
+    DailyLoad.objects.filter(user=user, date__in=loads).update(
+        load=F("load") + Case(
+            *[When(date=day, then=Value(cost)) for day, cost in loads.items()],
+            default=Value(0),
+        )
+    )
+
+
+def rebuild_loads(user_ids, days):
+    # The ledger rows of those days recomputed from the completions left
+    # on them, each at the load it was charged: for completions deleted or
+    # moved outside mark_complete. Days left empty lose their row.
+    user_ids, days = list(user_ids), list(days)
+    rows = (
+        HabitCompletion.objects
+        .filter(habit__user_id__in=user_ids, date__in=days)
+        .values("habit__user_id", "date")
+        .annotate(cost=Sum("load"))
+        .order_by()
+    )
+
+    DailyLoad.objects.filter(user_id__in=user_ids, date__in=days).delete()
+    DailyLoad.objects.bulk_create(
+        (
+            DailyLoad(user_id=row["habit__user_id"], date=row["date"], load=row["cost"])
+            for row in rows.iterator()
+        ),
+        batch_size=500,
+    )
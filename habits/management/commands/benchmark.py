@@ -0,0 +1,125 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases
+from django.utils import timezone
+
+from habits.benchmark import (
+    generate_fixtures,
+    planner_timing,
+    run_benchmarks,
+    shard_throughput,
+    throughput,
+    write_throughput,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users x habits x days of history in a throwaway test "
+        "database and report query count, p50/p95 latency and peak memory per view."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=5)
+        parser.add_argument("--habits", type=int, default=10, help="Habits per user.")
+        parser.add_argument("--days", type=int, default=365, help="Days of completion history.")
+        parser.add_argument("--repeat", type=int, default=50, help="Requests per view.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--concurrency", type=int, default=0,
+            help=(
+                "Also compare dashboard requests/sec under WSGI and ASGI, and completion "
+                "writes/sec under default and tuned SQLite pragmas, with this many in flight."
+            ),
+        )
+        parser.add_argument(
+            "--shards", type=int, default=0,
+            help=(
+                "With --concurrency, also measure completion writes/sec with the users "
+                "spread over 1, 2, ... this many temporary SQLite shards."
+            ),
+        )
+        parser.add_argument("--output", default="bench_output.json", help="JSON results file.")
+        parser.add_argument("--baseline", help="Earlier JSON results to compare against.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        databases = setup_databases(verbosity=0, interactive=False)
+        try:
+            today = timezone.now().date()
+
+            started = time.perf_counter()
+            user_ids = generate_fixtures(
+                options["users"], options["habits"], options["days"], today, seed=options["seed"]
+            )
+            generated = time.perf_counter() - started
+
+            results = run_benchmarks(user_ids, options["repeat"])
+            planner = planner_timing(user_ids, today, options["repeat"])
+            if options["concurrency"]:
+                requests = options["repeat"] * options["concurrency"]
+                # Writes first: switching the journal mode needs every other
+                # connection closed, and the ASGI run leaves one on its thread.
+                rates = write_throughput(user_ids, requests, options["concurrency"], today)
+                rates.update(throughput(user_ids, requests, options["concurrency"]))
+                if options["shards"]:
+                    # Last: the users' rows end up on shards that are gone afterwards
+                    shards = shard_throughput(
+                        user_ids, requests, options["concurrency"], today, options["shards"]
+                    )
+        finally:
+            teardown_databases(databases, verbosity=0)
+
+        report = {
+            "fixtures": {
+                key: options[key] for key in ("users", "habits", "days", "repeat", "seed")
+            },
+            "generate_s": round(generated, 2),
+            "views": results,
+            "planner": planner,
+        }
+        if options["concurrency"]:
+            report["throughput"] = rates
+        if options["concurrency"] and options["shards"]:
+            report["shards"] = shards
+        with open(options["output"], "w") as f:
+            json.dump(report, f, indent=2)
+
+        baseline = {}
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)["views"]
+
+        for view, r in results.items():
+            line = (
+                f"{view:<18} {r['queries']:>4} queries  p50 {r['p50_ms']:>8.2f} ms  "
+                f"p95 {r['p95_ms']:>8.2f} ms  peak {r['peak_kb']:>9.1f} KiB"
+            )
+            if view in baseline:
+                before = baseline[view]
+                line += (
+                    f"  ({r['queries'] - before['queries']:+d} queries, "
+                    f"p50 x{r['p50_ms'] / before['p50_ms']:.2f})"
+                )
+            self.stdout.write(line)
+        self.stdout.write(
+            f"planner            {planner['plans']} plans: solve p50 {planner['solve_p50_us']} us, "
+            f"p95 {planner['solve_p95_us']} us; plan_all {planner['batch_us_per_plan']} us/plan"
+        )
+        if options["concurrency"]:
+            self.stdout.write(
+                f"throughput         {rates['requests']} dashboard requests, {rates['concurrency']} in flight: "
+                f"WSGI {rates['wsgi_rps']} req/s, ASGI {rates['asgi_rps']} req/s"
+            )
+            self.stdout.write(
+                f"sqlite writes      {rates['writes']} completions, {rates['concurrency']} threads: "
+                f"default pragmas {rates['default_wps']}/s, SQLITE_PRAGMAS {rates['tuned_wps']}/s"
+            )
+        if options["concurrency"] and options["shards"]:
+            self.stdout.write(
+                f"sharded writes     {shards['writes']} completions, {shards['concurrency']} threads: "
+                + ", ".join(f"{count} shards {wps}/s" for count, wps in shards["wps"].items())
+            )
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}."))
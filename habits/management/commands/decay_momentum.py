@@ -0,0 +1,31 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from habits.momentum import decay_all
+from habits.sharding import each_shard
+
+
+class Command(BaseCommand):
+    help = "Apply momentum decay and difficulty auto-tuning to every active habit. Safe to rerun on the same day."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", type=date.fromisoformat, help="Run as of this day (YYYY-MM-DD), defaults to today.")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        today = options["date"] or timezone.now().date()
+
+        started = time.perf_counter()
+        result = {"processed": 0, "changed": 0}
+        for _ in each_shard():
+            for key, count in decay_all(today, chunk_size=options["chunk_size"]).items():
+                result[key] += count
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Decayed {result['processed']} habits ({result['changed']} changed) "
+            f"as of {today} in {elapsed:.2f}s."
+        ))
@@ -0,0 +1,36 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from habits.export import FORMATS, export_lines
+from habits.models import Habit
+from habits.sharding import each_shard
+
+
+class Command(BaseCommand):
+    help = "Stream every user's (or one user's) habit completions as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Only export habits of this username.")
+        parser.add_argument("--format", choices=list(FORMATS), default="csv")
+        parser.add_argument("--start", type=date.fromisoformat, help="First day (YYYY-MM-DD).")
+        parser.add_argument("--end", type=date.fromisoformat, help="Last day (YYYY-MM-DD).")
+        parser.add_argument("--derived", action="store_true", help="Add streak and replayed momentum columns.")
+        parser.add_argument("--output", help="File to write, defaults to stdout.")
+
+    def handle(self, *args, **options):
+        out = open(options["output"], "w", newline="") if options["output"] else sys.stdout
+        try:
+            for shard, user_id in enumerate(each_shard(options["user"])):
+                habits = Habit.objects.all()
+                if user_id:
+                    habits = habits.filter(user_id=user_id)
+
+                out.writelines(export_lines(
+                    habits, options["format"], options["start"], options["end"], options["derived"],
+                    header=shard == 0,
+                ))
+        finally:
+            if out is not sys.stdout:
+                out.close()
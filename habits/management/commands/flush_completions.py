@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from habits.writebehind import FLUSH_BATCH, flush_completions
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply queued write-behind completions (COMPLETION_WRITE_BEHIND) in batches, "
+        "oldest first. Once by default, or continuously with --loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=FLUSH_BATCH, help="Events per transaction.")
+        parser.add_argument("--loop", action="store_true", help="Keep flushing until interrupted.")
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds between passes with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            flushed = flush_completions(options["batch_size"])
+            elapsed = time.perf_counter() - started
+
+            if flushed or not options["loop"]:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Applied {flushed} queued completions in {elapsed:.2f}s."
+                ))
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
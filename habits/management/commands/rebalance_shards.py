@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from habits.sharding import move_user, rebalance_plan, shard_for
+
+
+class Command(BaseCommand):
+    help = (
+        "Move users' habits, completions, profile and rollups between HABIT_SHARDS: one "
+        "user with --user/--to, otherwise evenly, starting with users still on default "
+        "or on a database no longer listed in HABIT_SHARDS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Move only this username (needs --to).")
+        parser.add_argument("--to", help="Target database alias.")
+        parser.add_argument("--dry-run", action="store_true", help="Only print the moves.")
+
+    def handle(self, *args, **options):
+        shards = settings.HABIT_SHARDS
+        if not shards:
+            raise CommandError("HABIT_SHARDS is empty, there is nothing to rebalance.")
+
+        if options["user"]:
+            if options["to"] not in shards:
+                raise CommandError(f"--to must be one of {', '.join(shards)}.")
+            user_id = User.objects.filter(username=options["user"]).values_list("pk", flat=True).first()
+            if user_id is None:
+                raise CommandError(f"Unknown user {options['user']!r}.")
+            plan = {user_id: options["to"]}
+        else:
+            plan = rebalance_plan()
+
+        usernames = dict(User.objects.filter(pk__in=plan).values_list("pk", "username"))
+        started = time.perf_counter()
+        habits = 0
+        for user_id, target in sorted(plan.items()):
+            self.stdout.write(f"{usernames[user_id]}: {shard_for(user_id)} -> {target}")
+            if not options["dry_run"]:
+                habits += move_user(user_id, target)
+        elapsed = time.perf_counter() - started
+
+        if options["dry_run"]:
+            self.stdout.write(self.style.SUCCESS(f"Would move {len(plan)} users."))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Moved {len(plan)} users ({habits} habits) in {elapsed:.2f}s."
+            ))
@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from habits.rollups import rebuild_daily_scores
+from habits.sharding import by_shard, use_shard
+from habits.snapshots import bump_dashboard
+
+
+class Command(BaseCommand):
+    help = "Backfill the UserDailyScore rollup from HabitCompletion history, scoring each completion at its habit's current settings."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Only rebuild the rollup of this username.")
+        parser.add_argument("--chunk-size", type=int, default=100, help="Users per transaction.")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by("pk")
+        if options["user"]:
+            users = users.filter(username=options["user"])
+
+        user_ids = list(users.values_list("pk", flat=True))
+        chunk_size = options["chunk_size"]
+
+        for db, shard_user_ids in by_shard(user_ids).items():
+            with use_shard(db):
+                for start in range(0, len(shard_user_ids), chunk_size):
+                    with transaction.atomic(using=db):
+                        rebuild_daily_scores(shard_user_ids[start:start + chunk_size])
+                        bump_dashboard(*shard_user_ids[start:start + chunk_size])
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt daily scores for {len(user_ids)} users."))
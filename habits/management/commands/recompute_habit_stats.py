@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from habits.bitmaps import rebuild_bitmaps
+from habits.models import Habit
+from habits.sharding import current_db, each_shard
+from habits.streaks import refresh_habit_stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized streak/completion columns on Habit and the completion bitmaps from HabitCompletion history."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Only rebuild habits of this username.")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        total = 0
+
+        for user_id in each_shard(options["user"]):
+            habits = Habit.objects.order_by("pk")
+            if user_id:
+                habits = habits.filter(user_id=user_id)
+
+            habit_ids = list(habits.values_list("pk", flat=True))
+            for start in range(0, len(habit_ids), chunk_size):
+                with transaction.atomic(using=current_db()):
+                    refresh_habit_stats(habit_ids[start:start + chunk_size])
+                    rebuild_bitmaps(habit_ids[start:start + chunk_size])
+            total += len(habit_ids)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {total} habits."))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from habits import momentum
+from habits.models import Habit
+from habits.sharding import each_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute momentum, difficulty and last_activity of every habit from its "
+        "completion history (vectorized with NumPy when it is installed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Only replay habits of this username.")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Habits per matrix.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = 0
+        for user_id in each_shard(options["user"]):
+            habits = Habit.objects.all()
+            if user_id:
+                habits = habits.filter(user_id=user_id)
+            habit_ids = list(habits.values_list("pk", flat=True))
+
+            momentum.replay_habits(habit_ids, chunk_size=options["chunk_size"])
+            total += len(habit_ids)
+        elapsed = time.perf_counter() - started
+
+        engine = "numpy" if momentum.np is not None else "python"
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {total} habits ({engine}) in {elapsed:.2f}s."
+        ))
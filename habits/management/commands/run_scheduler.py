@@ -0,0 +1,61 @@
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from habits.scheduler import CHUNK_SIZE, JOBS, run_daily_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the daily jobs (snapshot expiry, momentum decay and difficulty retune, "
+        "yesterday's missing score rollups, today's planner suggestions) at every day "
+        "rollover, users spread over worker processes in id-range chunks. Finished "
+        "chunks are checkpointed, so a rerun for the same day resumes where the last "
+        "one stopped. The cache jobs are skipped unless the cache backend is shared."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run today's jobs and exit, e.g. from cron.")
+        parser.add_argument("--date", type=date.fromisoformat, help="Run once as of this day (YYYY-MM-DD).")
+        parser.add_argument("--jobs", nargs="+", choices=list(JOBS), help="Only these jobs.")
+        parser.add_argument("--workers", type=int, help="Worker processes, defaults to the CPU count.")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="User ids per chunk.")
+        parser.add_argument(
+            "--delay", type=int, default=60,
+            help="Seconds to wait past midnight, so the last requests of the day land first.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            day = options["date"] or timezone.now().date()
+            failed = self.run(day, options)
+            if failed:
+                raise CommandError(f"{failed} failed, rerun to resume {day}.")
+            if options["once"] or options["date"]:
+                return
+
+            midnight = datetime.combine(day + timedelta(days=1), datetime.min.time(), dt_timezone.utc)
+            time.sleep(max(0, (midnight - timezone.now()).total_seconds()) + options["delay"])
+
+    def run(self, day, options):
+        report = run_daily_jobs(day, options["workers"], options["chunk_size"], options["jobs"])
+
+        failed = []
+        for name, r in report.items():
+            if r["skipped"]:
+                self.stdout.write(f"{day} {name:<10} skipped: {r['skipped']}")
+                continue
+            self.stdout.write(
+                f"{day} {name:<10} {r['processed']:>8} rows in {r['seconds']:>7.2f}s "
+                f"({r['per_second']:,.0f}/s), {r['chunks']} chunks, {r['resumed']} already done"
+            )
+            for error in r["errors"]:
+                self.stderr.write(f"{name} {error}")
+            if r["errors"]:
+                failed.append(name)
+
+        if not failed:
+            self.stdout.write(self.style.SUCCESS(f"Daily jobs for {day} done."))
+        return ", ".join(failed)
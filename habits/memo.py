@@ -0,0 +1,20 @@
+from functools import wraps
+
+
+def derived(method):
+    # Memoized per instance until forget_derived(). Model instances live
+    # for one request, so each value is computed at most once per render.
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(self):
+        memo = self.__dict__.setdefault("_derived", {})
+        if name not in memo:
+            memo[name] = method(self)
+        return memo[name]
+
+    return wrapper
+
+
+def forget_derived(instance):
+    instance.__dict__.pop("_derived", None)
@@ -0,0 +1,96 @@
+# Generated by Django 6.0 on 2026-10-17 16:18
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+# A frozen copy of habits.streaks.fold_islands as it stood for this
+# migration: {habit_id: (run, longest, last, count)} from (habit_id, date)
+# rows in habit, date order. run is the most recent island, whether or
+# not it ends today.
+def fold_islands(rows):
+    stats = {}
+    habit_id = None
+    prev = None
+    run = longest = count = 0
+
+    def close():
+        if habit_id is not None:
+            stats[habit_id] = (run, max(longest, run), prev, count)
+
+    for pk, day in rows:
+        if pk != habit_id:
+            close()
+            habit_id, prev = pk, day
+            run, longest, count = 1, 0, 1
+            continue
+
+        count += 1
+        if day == prev + timedelta(days=1):
+            run += 1
+        else:
+            longest = max(longest, run)
+            run = 1
+        prev = day
+
+    close()
+    return stats
+
+
+def backfill_stats(apps, schema_editor):
+    Habit = apps.get_model('habits', 'Habit')
+    HabitCompletion = apps.get_model('habits', 'HabitCompletion')
+
+    rows = (
+        HabitCompletion.objects
+        .order_by('habit_id', 'date')
+        .values_list('habit_id', 'date')
+    )
+    stats = fold_islands(rows.iterator())
+
+    Habit.objects.bulk_update(
+        [
+            Habit(
+                pk=pk,
+                streak_length=run,
+                longest_streak=longest,
+                last_completed=last,
+                completion_count=count,
+            )
+            for pk, (run, longest, last, count) in stats.items()
+        ],
+        ['streak_length', 'longest_streak', 'last_completed', 'completion_count'],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0007_habit_identity_alter_habit_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='habit',
+            name='completion_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='habit',
+            name='last_completed',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='habit',
+            name='longest_streak',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='habit',
+            name='streak_length',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0008_habit_stats_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='data_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0009_userprofile_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='habit',
+            name='last_decayed',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
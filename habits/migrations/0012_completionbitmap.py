@@ -0,0 +1,63 @@
+# Generated by Django 6.0 on 2026-10-17 16:25
+
+from collections import defaultdict
+from datetime import date
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Frozen copies of the habits.bitmaps helpers as they stood for this
+# migration: bit n of a year's 46 bytes is day n of that year, from 0.
+YEAR_BYTES = 46
+
+
+def group_by_year(habit_days):
+    groups = defaultdict(set)
+    for habit_id, day in habit_days:
+        groups[(habit_id, day.year)].add(day.toordinal() - date(day.year, 1, 1).toordinal())
+    return groups
+
+
+def set_bits(bits, positions):
+    bits = bytearray(bits or bytes(YEAR_BYTES))
+    for pos in positions:
+        bits[pos >> 3] |= 1 << (pos & 7)
+    return bytes(bits)
+
+
+def backfill_bitmaps(apps, schema_editor):
+    HabitCompletion = apps.get_model('habits', 'HabitCompletion')
+    CompletionBitmap = apps.get_model('habits', 'CompletionBitmap')
+
+    groups = group_by_year(HabitCompletion.objects.values_list('habit_id', 'date').iterator())
+    CompletionBitmap.objects.bulk_create(
+        [
+            CompletionBitmap(habit_id=habit_id, year=year, bits=set_bits(None, positions))
+            for (habit_id, year), positions in groups.items()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0011_dailyload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompletionBitmap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('bits', models.BinaryField(max_length=46)),
+                ('habit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bitmaps', to='habits.habit')),
+            ],
+            options={
+                'unique_together': {('habit', 'year')},
+            },
+        ),
+        migrations.RunPython(backfill_bitmaps, migrations.RunPython.noop),
+    ]
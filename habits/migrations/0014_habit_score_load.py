@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-17 16:35
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0013_userdailyscore'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='habit',
+            name='load',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.Case(models.When(difficulty='easy', then=models.Value(1)), models.When(difficulty='normal', then=models.Value(2)), models.When(difficulty='hard', then=models.Value(3)), default=models.Value(2), output_field=models.IntegerField()), '*', models.Case(models.When(priority='low', then=models.Value(1)), models.When(priority='medium', then=models.Value(2)), models.When(priority='high', then=models.Value(3)), default=models.Value(1), output_field=models.IntegerField())), output_field=models.IntegerField()),
+        ),
+        migrations.AddField(
+            model_name='habit',
+            name='score',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('weight'), '*', models.Case(models.When(priority='low', then=models.Value(1)), models.When(priority='medium', then=models.Value(2)), models.When(priority='high', then=models.Value(3)), default=models.Value(1), output_field=models.IntegerField())), '*', models.Case(models.When(difficulty='easy', then=models.Value(0.8)), models.When(difficulty='normal', then=models.Value(1.0)), models.When(difficulty='hard', then=models.Value(1.3)), default=models.Value(1.0), output_field=models.FloatField())), output_field=models.FloatField()),
+        ),
+    ]
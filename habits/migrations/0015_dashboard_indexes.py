@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-17 16:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0014_habit_score_load'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='habit',
+            index=models.Index(fields=['user', 'is_active'], name='habit_user_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='habit',
+            index=models.Index(fields=['-created_at'], name='habit_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='habitcompletion',
+            index=models.Index(fields=['date', 'habit'], name='completion_date_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-17 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0016_usershard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.CharField(max_length=50)),
+                ('day', models.DateField()),
+                ('shard', models.CharField(max_length=100)),
+                ('first_user', models.PositiveIntegerField()),
+                ('stop_user', models.PositiveIntegerField()),
+                ('processed', models.PositiveIntegerField(default=0)),
+                ('seconds', models.FloatField(default=0.0)),
+                ('finished_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('job', 'day', 'shard', 'first_user', 'stop_user')},
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-17 18:24
+
+from django.db import migrations, models
+
+
+# Frozen copy of habits.momentum.DECAY_RATE as it stood for this migration
+DECAY_RATE = 0.15
+
+
+def backfill_base_momentum(apps, schema_editor):
+    # Decay used to be charged on the already decayed momentum from the
+    # last decay run. Take the base back out of it, so momentum as of that
+    # run is unchanged where the linear rule can reach it, and zero where
+    # the linear rule has already run out.
+    Habit = apps.get_model('habits', 'Habit')
+
+    habits = []
+    for habit in Habit.objects.only('id', 'momentum', 'last_activity', 'last_decayed').iterator():
+        habit.base_momentum = habit.momentum
+        if habit.last_activity and habit.last_decayed and habit.last_decayed > habit.last_activity:
+            factor = 1 - DECAY_RATE * (habit.last_decayed - habit.last_activity).days
+            if factor > 0:
+                habit.base_momentum = habit.momentum / factor
+            else:
+                habit.momentum = 0.0
+        habits.append(habit)
+    Habit.objects.bulk_update(habits, ['momentum', 'base_momentum'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0018_completionevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='habit',
+            name='base_momentum',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(backfill_base_momentum, migrations.RunPython.noop),
+    ]
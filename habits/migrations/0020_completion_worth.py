@@ -0,0 +1,39 @@
+# Generated by Django 6.0 on 2026-10-17 18:28
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_worth(apps, schema_editor):
+    # What each completion was worth on its day was never kept; the
+    # habit's current score and load is what the rollups were rebuilt from
+    # until now, so existing rows keep adding up to the same totals.
+    Habit = apps.get_model('habits', 'Habit')
+    HabitCompletion = apps.get_model('habits', 'HabitCompletion')
+
+    habit = Habit.objects.filter(pk=OuterRef('habit_id'))
+    HabitCompletion.objects.update(
+        score=Subquery(habit.values('score')[:1]),
+        load=Subquery(habit.values('load')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0019_habit_base_momentum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='habitcompletion',
+            name='load',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='habitcompletion',
+            name='score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(backfill_worth, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-17 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0020_completion_worth'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HabitSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='usershard',
+            name='moving',
+            field=models.BooleanField(default=False),
+        ),
+    ]
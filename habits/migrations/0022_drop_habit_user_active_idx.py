@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-17 18:41
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0021_stable_habit_ids'),
+    ]
+
+    operations = [
+        # SQLite compares is_active as a bare column, so every dashboard
+        # query reads the habits through the user foreign key index instead
+        migrations.RemoveIndex(
+            model_name='habit',
+            name='habit_user_active_idx',
+        ),
+    ]
@@ -1,14 +1,56 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from datetime import timedelta
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
+from datetime import timedelta
+
+from .consistency import habit_consistency, percent
+from .memo import derived, forget_derived
+from .momentum import decayed, inactive_days, tuned_difficulty
+from .sharding import allocate_habit_ids, place_user
+from .scoring import (
+    BURNOUT_LOAD,
+    BURNOUT_MOMENTUM,
+    DIFFICULTY_LOAD,
+    DIFFICULTY_MULTIPLIERS,
+    LOAD_EXPRESSION,
+    PRIORITY_MULTIPLIERS,
+    SCORE_EXPRESSION,
+)
+from .streaks import STATS_FIELDS, apply_stats, streak_stats
+
+
+class UserShard(models.Model):
+    # Which HABIT_SHARDS database holds the user's rows, see sharding.py.
+    # Users without a row are on default.
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="shard")
+    alias = models.CharField(max_length=100)
+    # Set while move_user() copies the user's rows away from alias
+    moving = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.alias}"
+
+
+class HabitSequence(models.Model):
+    # The last habit id handed out, one row on default, see
+    # sharding.allocate_habit_ids()
+    last = models.BigIntegerField(default=0)
+
+
+# Also the cap of a user whose profile row is missing
+DEFAULT_DAILY_LOAD_CAP = 10
 
 
+# The user foreign keys below may point into another database, so they
+# carry no database constraint.
 class UserProfile(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE)
-    daily_load_cap = models.IntegerField(default=10)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, db_constraint=False)
+    daily_load_cap = models.IntegerField(default=DEFAULT_DAILY_LOAD_CAP)
+
+    # Bumped on every change the dashboard depends on, see snapshots.py
+    data_version = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
@@ -17,7 +59,7 @@ class UserProfile(models.Model):
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        UserProfile.objects.create(user=instance)
+        UserProfile.objects.using(place_user(instance.pk)).create(user=instance)
 
 
 class Habit(models.Model):
@@ -41,7 +83,9 @@ class Habit(models.Model):
         ("recovery", "Recovery"),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="habits")
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="habits", db_constraint=False
+    )
     identity = models.CharField(max_length=20, choices=IDENTITY_CHOICES, default="discipline")
     name = models.CharField(max_length=100)
 
@@ -52,26 +96,57 @@ class Habit(models.Model):
     is_active = models.BooleanField(default=True)
 
     momentum = models.FloatField(default=0.0)
+    # momentum right after the last completion; decay is charged on it
+    base_momentum = models.FloatField(default=0.0)
     last_activity = models.DateField(null=True, blank=True)
+    last_decayed = models.DateField(null=True, blank=True)
+
+    # Denormalized from HabitCompletion, see record_completion()
+    streak_length = models.PositiveIntegerField(default=0)
+    longest_streak = models.PositiveIntegerField(default=0)
+    last_completed = models.DateField(null=True, blank=True)
+    completion_count = models.PositiveIntegerField(default=0)
+
+    # Computed by the database from weight/priority/difficulty, so totals
+    # and filters work in SQL. Python code on a live instance should call
+    # discipline_score()/load_cost(), which see unsaved changes.
+    score = models.GeneratedField(
+        expression=SCORE_EXPRESSION, output_field=models.FloatField(), db_persist=True
+    )
+    load = models.GeneratedField(
+        expression=LOAD_EXPRESSION, output_field=models.IntegerField(), db_persist=True
+    )
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Admin changelist ordering
+            models.Index(fields=["-created_at"], name="habit_created_idx"),
+        ]
+
     def __str__(self):
         return self.name
 
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        forget_derived(self)
+
     # ---------------- STREAKS ----------------
 
+    @derived
     def current_streak(self):
-        today = timezone.now().date()
-        streak = 0
-        day = today
-
-        while self.completions.filter(date=day).exists():
-            streak += 1
-            day -= timedelta(days=1)
+        if self.last_completed != timezone.now().date():
+            return 0
+        return self.streak_length
 
-        return streak
+    @derived
+    def streak_start(self):
+        if not self.current_streak():
+            return None
+        return self.last_completed - timedelta(days=self.streak_length - 1)
 
+    @derived
     def effective_streak(self):
         if self.momentum >= 50:
             return self.current_streak() + 2
@@ -79,13 +154,14 @@ class Habit(models.Model):
             return self.current_streak() + 1
         return self.current_streak()
 
+    @derived
     def streak_percentage(self):
         return min(self.effective_streak() * 10, 100)
 
     def last_completed_date(self):
-        last = self.completions.order_by("-date").first()
-        return last.date if last else None
+        return self.last_completed
 
+    @derived
     def missed_days(self):
         last = self.last_completed_date()
         if not last:
@@ -93,64 +169,135 @@ class Habit(models.Model):
         delta = (timezone.now().date() - last).days
         return max(0, delta - 1)
 
+    def consistency_index(self, days=30, today=None):
+        stats = habit_consistency(Habit.objects.filter(pk=self.pk), today, days)
+        return percent(*stats[self.pk]) if self.pk in stats else 0
+
+    # The mutators below return the fields they touched; with commit=False
+    # the caller collects them and writes the row once. Each one drops the
+    # memoized derived values it may have changed.
+
+    def record_completion(self, day, commit=True):
+        if self.last_completed and day <= self.last_completed:
+            # Backfilled into history: the run may have merged, rebuild it
+            apply_stats(self, streak_stats([self.pk], today=max(day, self.last_completed))[self.pk])
+        else:
+            if self.last_completed == day - timedelta(days=1):
+                self.streak_length += 1
+            else:
+                self.streak_length = 1
+
+            self.longest_streak = max(self.longest_streak, self.streak_length)
+            self.last_completed = day
+            self.completion_count += 1
+
+        forget_derived(self)
+        if commit:
+            self.save(update_fields=STATS_FIELDS)
+        return STATS_FIELDS
+
     # ---------------- LOAD & SCORING ----------------
 
+    @derived
     def priority_multiplier(self):
-        return {"low": 1, "medium": 2, "high": 3}.get(self.priority, 1)
+        return PRIORITY_MULTIPLIERS.get(self.priority, 1)
 
+    @derived
     def difficulty_multiplier(self):
-        return {"easy": 0.8, "normal": 1.0, "hard": 1.3}.get(self.difficulty, 1.0)
+        return DIFFICULTY_MULTIPLIERS.get(self.difficulty, 1.0)
 
+    @derived
     def load_cost(self):
-        base = {"easy": 1, "normal": 2, "hard": 3}.get(self.difficulty, 2)
+        base = DIFFICULTY_LOAD.get(self.difficulty, 2)
         return base * self.priority_multiplier()
 
+    @derived
     def discipline_score(self):
         return self.weight * self.priority_multiplier() * self.difficulty_multiplier()
 
     # ---------------- INTELLIGENCE ----------------
 
+    @derived
     def burnout_risk(self):
-        if self.load_cost() >= 6 and self.momentum >= 70:
+        if self.load_cost() >= BURNOUT_LOAD and self.momentum >= BURNOUT_MOMENTUM:
             return "high"
         return "normal"
 
-    def gain_momentum(self):
+    def gain_momentum(self, day=None, commit=True):
+        day = day or timezone.now().date()
         gain = (
             self.weight
             * self.priority_multiplier()
             * self.difficulty_multiplier()
         )
-        self.momentum += gain
-        self.last_activity = timezone.now().date()
-        self.save(update_fields=["momentum", "last_activity"])
+        # The stored momentum is as of the later of the last completion and
+        # the last decay run, and stays so
+        as_of = max(d for d in (day, self.last_activity, self.last_decayed) if d)
+        if self.last_activity and day < self.last_activity:
+            # Backfilled: counted at the last completion, not replayed
+            self.base_momentum += gain
+        else:
+            self.base_momentum = (
+                decayed(self.base_momentum, inactive_days(self.last_activity, day)) + gain
+            )
+            self.last_activity = day
+        self.momentum = decayed(self.base_momentum, inactive_days(self.last_activity, as_of))
+        forget_derived(self)
+
+        fields = ["momentum", "base_momentum", "last_activity"]
+        if commit:
+            self.save(update_fields=fields)
+        return fields
+
+    def decay_momentum(self, day=None, commit=True):
+        day = day or timezone.now().date()
+        days_inactive = inactive_days(self.last_activity, day)
+        if days_inactive <= 0 or (self.last_decayed and day <= self.last_decayed):
+            return []
+
+        self.momentum = decayed(self.base_momentum, days_inactive)
+        self.last_decayed = day
+        forget_derived(self)
+
+        fields = ["momentum", "last_decayed"]
+        if commit:
+            self.save(update_fields=fields)
+        return fields
+
+    def auto_tune_difficulty(self, commit=True):
+        old = self.difficulty
 
-    def decay_momentum(self):
-        if not self.last_activity:
-            return
+        self.difficulty = tuned_difficulty(self.momentum)
 
-        days_inactive = (timezone.now().date() - self.last_activity).days
-        if days_inactive <= 0:
-            return
+        if self.difficulty == old:
+            return []
+        forget_derived(self)
+        if commit:
+            self.save(update_fields=["difficulty"])
+        return ["difficulty"]
 
-        decay_rate = 0.15
-        decay = self.momentum * decay_rate * days_inactive
-        self.momentum = max(0, self.momentum - decay)
 
-        self.save(update_fields=["momentum"])
+@receiver(pre_save, sender=Habit)
+def assign_habit_id(sender, instance, raw, **kwargs):
+    # Not the shard's own autoincrement: ids must stay unique when a user
+    # moves. bulk_create() skips this, callers allocate ids themselves.
+    if instance.pk is None and not raw:
+        instance.pk, = allocate_habit_ids(1)
 
-    def auto_tune_difficulty(self):
-        old = self.difficulty
 
-        if self.momentum >= 80:
-            self.difficulty = "hard"
-        elif self.momentum >= 40:
-            self.difficulty = "normal"
-        else:
-            self.difficulty = "easy"
+class DailyLoad(models.Model):
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="daily_loads", db_constraint=False
+    )
+    date = models.DateField()
+    load = models.PositiveIntegerField(default=0)
 
-        if self.difficulty != old:
-            self.save(update_fields=["difficulty"])
+    class Meta:
+        unique_together = ("user", "date")
+        ordering = ["-date"]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.date}: {self.load}"
 
 
 class HabitCompletion(models.Model):
@@ -158,10 +305,85 @@ class HabitCompletion(models.Model):
         Habit, on_delete=models.CASCADE, related_name="completions"
     )
     date = models.DateField()
+    # What it added to the daily rollups: the habit's score and load when
+    # it was recorded, so later edits to the habit leave past days alone
+    score = models.FloatField(default=0.0)
+    load = models.PositiveIntegerField(default=0)
 
     class Meta:
         unique_together = ("habit", "date")
         ordering = ["-date"]
+        indexes = [
+            # Date-range scans across habits: admin date filter and ordering,
+            # per-day sums over all users
+            models.Index(fields=["date", "habit"], name="completion_date_idx"),
+        ]
 
     def __str__(self):
         return f"{self.habit.name} - {self.date}"
+
+
+class CompletionEvent(models.Model):
+    # A mark_complete tap waiting for the write-behind flusher, see
+    # writebehind.py. Applied and deleted in id order.
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="completion_events", db_constraint=False
+    )
+    habit = models.ForeignKey(Habit, on_delete=models.CASCADE, related_name="events")
+    date = models.DateField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.habit_id} - {self.date} (queued)"
+
+
+class CompletionBitmap(models.Model):
+    # Compact mirror of HabitCompletion, one bit per day, see bitmaps.py
+    habit = models.ForeignKey(
+        Habit, on_delete=models.CASCADE, related_name="bitmaps"
+    )
+    year = models.PositiveSmallIntegerField()
+    bits = models.BinaryField(max_length=46)
+
+    class Meta:
+        unique_together = ("habit", "year")
+
+    def __str__(self):
+        return f"{self.habit.name} - {self.year}"
+
+
+class UserDailyScore(models.Model):
+    # Per-user, per-day rollup of completions for the trend chart, see rollups.py
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="daily_scores", db_constraint=False
+    )
+    date = models.DateField()
+    score = models.FloatField(default=0.0)
+    completions = models.PositiveIntegerField(default=0)
+    load = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("user", "date")
+        ordering = ["-date"]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.date}: {self.score}"
+
+
+class JobCheckpoint(models.Model):
+    # One finished chunk of a daily job, see scheduler.py. A rerun for the
+    # same day skips the chunks recorded here.
+    job = models.CharField(max_length=50)
+    day = models.DateField()
+    shard = models.CharField(max_length=100)
+    first_user = models.PositiveIntegerField()
+    stop_user = models.PositiveIntegerField()
+    processed = models.PositiveIntegerField(default=0)
+    seconds = models.FloatField(default=0.0)
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("job", "day", "shard", "first_user", "stop_user")
+
+    def __str__(self):
+        return f"{self.job} {self.day} {self.shard} [{self.first_user}, {self.stop_user})"
@@ -0,0 +1,227 @@
+from array import array
+from datetime import date
+
+from django.db import transaction
+
+try:
+    import numpy as np
+except ImportError:  # optional: replay_habits falls back to MomentumReplay
+    np = None
+
+from .scoring import DIFFICULTY_MULTIPLIERS, PRIORITY_MULTIPLIERS
+from .sharding import current_db
+
+
+DECAY_RATE = 0.15
+
+
+# Decay is linear in the days since the last completion and always
+# charged on base_momentum, the momentum as it stood right after that
+# completion. Momentum on a given day is therefore the same however often,
+# or rarely, the decay job ran before it.
+
+def inactive_days(last_activity, today):
+    if not last_activity:
+        return 0
+    return max(0, (today - last_activity).days)
+
+
+def decayed(momentum, days):
+    if days <= 0:
+        return momentum
+    return max(0, momentum - momentum * DECAY_RATE * days)
+
+
+def tuned_difficulty(momentum):
+    if momentum >= 80:
+        return "hard"
+    if momentum >= 40:
+        return "normal"
+    return "easy"
+
+
+class MomentumReplay:
+    # Replays mark_complete's rules over one habit's completion days,
+    # oldest first: decay since the previous completion, gain at the
+    # current difficulty, then re-tune. The daily decay job is not
+    # replayed, its run days are not recorded.
+
+    def __init__(self, weight, priority, difficulty="normal"):
+        self.weight = weight
+        self.priority = priority
+        self.difficulty = difficulty
+        self.momentum = 0.0
+        self.last_activity = None
+
+    def complete(self, day):
+        self.momentum = decayed(self.momentum, inactive_days(self.last_activity, day))
+        self.momentum += (
+            self.weight
+            * PRIORITY_MULTIPLIERS.get(self.priority, 1)
+            * DIFFICULTY_MULTIPLIERS.get(self.difficulty, 1.0)
+        )
+        self.difficulty = tuned_difficulty(self.momentum)
+        self.last_activity = day
+        return self.momentum
+
+
+def decay_all(today, chunk_size=2000, users=None):
+    # Habits on the current shard, see sharding.each_shard(); users limits
+    # it to a range of user ids
+    from .models import Habit
+    from .snapshots import bump_dashboard
+
+    pending = (
+        Habit.objects
+        .filter(is_active=True)
+        .exclude(last_decayed__gte=today)
+        .only(
+            "id", "user_id", "momentum", "base_momentum", "difficulty", "last_activity",
+            "last_decayed",
+        )
+        .order_by("pk")
+    )
+    if users is not None:
+        pending = pending.filter(user_id__gte=users.start, user_id__lt=users.stop)
+
+    processed = changed = 0
+    last_pk = 0
+
+    while True:
+        chunk = list(pending.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+
+        bumped = set()
+        for habit in chunk:
+            momentum = decayed(habit.base_momentum, inactive_days(habit.last_activity, today))
+            difficulty = tuned_difficulty(momentum)
+
+            if momentum != habit.momentum or difficulty != habit.difficulty:
+                bumped.add(habit.user_id)
+                changed += 1
+
+            habit.momentum = momentum
+            habit.difficulty = difficulty
+            habit.last_decayed = today
+
+        with transaction.atomic(using=current_db()):
+            Habit.objects.bulk_update(
+                chunk, ["momentum", "difficulty", "last_decayed"], batch_size=500
+            )
+            if bumped:
+                bump_dashboard(*bumped)
+
+        processed += len(chunk)
+
+    return {"processed": processed, "changed": changed}
+
+
+def replay_loop(habits, rows):
+    # {pk: (momentum, difficulty, last_activity)} for every habit in rows,
+    # which must be ordered by habit then date.
+    replays = {}
+    for habit_id, day in rows:
+        if habit_id not in replays:
+            habit = habits[habit_id]
+            replays[habit_id] = MomentumReplay(habit.weight, habit.priority)
+        replays[habit_id].complete(day)
+
+    return {
+        pk: (replay.momentum, replay.difficulty, replay.last_activity)
+        for pk, replay in replays.items()
+    }
+
+
+TUNED = ["easy", "normal", "hard"]
+
+
+def replay_matrix(habits, rows):
+    # Same rules as MomentumReplay on a habits x days matrix: one vector
+    # step per day that has any completion, across every habit at once.
+    # The arithmetic is done in the same order, so results match exactly.
+    index = {pk: i for i, pk in enumerate(habits)}
+    # "q" and int64 are 8 bytes everywhere; "l" is 4 on Windows, where
+    # NumPy 2's default int is 8
+    habit_idx, ordinals = array("q"), array("q")
+    for habit_id, day in rows:
+        habit_idx.append(index[habit_id])
+        ordinals.append(day.toordinal())
+    if not ordinals:
+        return {}
+
+    habit_idx = np.frombuffer(habit_idx, dtype=np.int64)
+    ordinals = np.frombuffer(ordinals, dtype=np.int64)
+    first = ordinals.min()
+
+    done = np.zeros((len(index), ordinals.max() - first + 1), dtype=bool)
+    done[habit_idx, ordinals - first] = True
+
+    base = np.array([
+        habit.weight * PRIORITY_MULTIPLIERS.get(habit.priority, 1)
+        for habit in habits.values()
+    ])
+    multiplier = np.array([DIFFICULTY_MULTIPLIERS[name] for name in TUNED])
+
+    momentum = np.zeros(len(index))
+    difficulty = np.full(len(index), TUNED.index("normal"))
+    last = np.full(len(index), -1)
+
+    for d in np.flatnonzero(done.any(axis=0)):
+        hit = done[:, d]
+        m = momentum[hit]
+        gap = np.where(last[hit] >= 0, d - last[hit], 0)
+
+        m = np.where(gap > 0, np.maximum(0, m - m * DECAY_RATE * gap), m)
+        m = m + base[hit] * multiplier[difficulty[hit]]
+
+        momentum[hit] = m
+        difficulty[hit] = np.where(m >= 80, 2, np.where(m >= 40, 1, 0))
+        last[hit] = d
+
+    return {
+        pk: (float(momentum[i]), TUNED[difficulty[i]], date.fromordinal(int(first + last[i])))
+        for pk, i in index.items()
+        if last[i] >= 0
+    }
+
+
+def replay_habits(habit_ids, chunk_size=2000):
+    # Rebuild momentum, difficulty and last_activity from completion
+    # history alone, one chunk of habits at a time. Habits with no
+    # completions go back to zero momentum and keep their difficulty.
+    from .models import Habit, HabitCompletion
+    from .snapshots import bump_dashboard
+
+    engine = replay_matrix if np is not None else replay_loop
+
+    habit_ids = sorted(habit_ids)
+    for start in range(0, len(habit_ids), chunk_size):
+        habits = Habit.objects.only("id", "user_id", "weight", "priority", "difficulty").in_bulk(
+            habit_ids[start:start + chunk_size]
+        )
+        rows = (
+            HabitCompletion.objects
+            .filter(habit_id__in=habits)
+            .order_by("habit_id", "date")
+            .values_list("habit_id", "date")
+            .iterator(chunk_size=5000)
+        )
+        results = engine(habits, rows)
+
+        for pk, habit in habits.items():
+            habit.momentum, habit.difficulty, habit.last_activity = results.get(
+                pk, (0.0, habit.difficulty, None)
+            )
+            habit.base_momentum = habit.momentum
+            # Decay is charged again from the last completion
+            habit.last_decayed = None
+
+        with transaction.atomic(using=current_db()):
+            Habit.objects.bulk_update(
+                habits.values(),
+                ["momentum", "base_momentum", "difficulty", "last_activity", "last_decayed"],
+                batch_size=500,
+            )
+            bump_dashboard(*{habit.user_id for habit in habits.values()})
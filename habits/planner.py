@@ -0,0 +1,147 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .load import load_cap, today_load
+from .models import DEFAULT_DAILY_LOAD_CAP, DailyLoad, Habit, UserProfile
+from .sharding import user_shard
+from .snapshots import dashboard_version
+
+
+# Today's plan: of the active habits not yet done today, the set worth the
+# most whose loads still fit under what is left of daily_load_cap. A
+# habit is worth its discipline score, more if a streak ends tonight
+# without it, and more the longer it has been missed.
+
+STREAK_RISK_WEIGHT = 0.1  # per day of the streak at stake
+STREAK_RISK_CAP = 10
+MISSED_WEIGHT = 0.25  # per missed day
+MISSED_CAP = 4
+
+# The score and load columns are generated from discipline_score() and
+# load_cost(), so plans are built from plain rows, no model instances
+PLAN_FIELDS = ("pk", "user_id", "score", "load", "streak_length", "last_completed")
+
+Plan = namedtuple("Plan", ["habits", "value", "load", "capacity"])
+
+
+def plan_value(score, streak_length, last_completed, today):
+    if last_completed is None:
+        return score
+    gap = (today - last_completed).days
+    at_risk = streak_length if gap == 1 else 0
+    missed = max(0, gap - 1)
+    return (
+        score
+        * (1 + STREAK_RISK_WEIGHT * min(at_risk, STREAK_RISK_CAP))
+        * (1 + MISSED_WEIGHT * min(missed, MISSED_CAP))
+    )
+
+
+def best_subset(items, capacity):
+    # Exact 0/1 knapsack over (key, cost, value) with small integer costs.
+    # best[c] is the most value within load c; keep[i][c] records whether
+    # item i is in that best set, to walk the choice back afterwards.
+    # O(len(items) * capacity), and capacity is a daily_load_cap.
+    items = [item for item in items if item[1] <= capacity]
+    if sum(cost for _, cost, _ in items) <= capacity:
+        return [key for key, _, _ in items]
+
+    best = [0.0] * (capacity + 1)
+    keep = []
+    for _, cost, value in items:
+        row = bytearray(capacity + 1)
+        for c in range(capacity, cost - 1, -1):
+            if best[c - cost] + value > best[c]:
+                best[c] = best[c - cost] + value
+                row[c] = 1
+        keep.append(row)
+
+    chosen, c = [], capacity
+    for (key, cost, _), row in zip(reversed(items), reversed(keep)):
+        if row[c]:
+            chosen.append(key)
+            c -= cost
+    return chosen[::-1]
+
+
+def solve(rows, capacity, today):
+    # rows are PLAN_FIELDS tuples of one user's remaining habits
+    capacity = max(0, capacity)
+    costs, values = {}, {}
+    for pk, _, score, load, streak_length, last_completed in rows:
+        costs[pk] = load
+        values[pk] = plan_value(score, streak_length, last_completed, today)
+
+    chosen = best_subset([(pk, costs[pk], values[pk]) for pk in costs], capacity)
+    return Plan(
+        habits=chosen,
+        value=round(sum(values[pk] for pk in chosen), 2),
+        load=sum(costs[pk] for pk in chosen),
+        capacity=capacity,
+    )
+
+
+def remaining_habits(habits, today):
+    # exclude() keeps the never-completed rows, last_completed IS NULL
+    return (
+        habits.filter(is_active=True)
+        .exclude(last_completed=today)
+        .order_by("pk")
+        .values_list(*PLAN_FIELDS)
+    )
+
+
+def plan_for(user, today=None):
+    today = today or timezone.now().date()
+    with user_shard(user.pk):
+        cap = load_cap(user)
+        rows = list(remaining_habits(Habit.objects.filter(user=user), today))
+        used = today_load(user, today)
+    return solve(rows, cap - used, today)
+
+
+def plan_all(today, users=None):
+    # {user_id: Plan} for every user on the current shard, or for those
+    # whose id falls in the range users: three queries however many users.
+    # Users with habits or load but no profile row get the default cap,
+    # as in plan_for().
+    profiles = UserProfile.objects.all()
+    habits = Habit.objects.all()
+    loads = DailyLoad.objects.filter(date=today)
+    if users is not None:
+        profiles = profiles.filter(user_id__gte=users.start, user_id__lt=users.stop)
+        habits = habits.filter(user_id__gte=users.start, user_id__lt=users.stop)
+        loads = loads.filter(user_id__gte=users.start, user_id__lt=users.stop)
+
+    caps = dict(profiles.values_list("user_id", "daily_load_cap"))
+    used = dict(loads.values_list("user_id", "load"))
+    rows = {}
+    for row in remaining_habits(habits, today):
+        rows.setdefault(row[1], []).append(row)
+
+    return {
+        user_id: solve(
+            rows.get(user_id, []),
+            caps.get(user_id, DEFAULT_DAILY_LOAD_CAP) - used.get(user_id, 0),
+            today,
+        )
+        for user_id in caps.keys() | rows.keys() | used.keys()
+    }
+
+
+# A plan depends on the same rows as the dashboard, so it is cached
+# under the same data_version and date.
+def plan_key(user_id, version, today):
+    return f"habits:plan:{user_id}:{version}:{today.isoformat()}"
+
+
+def cached_plan(user, today):
+    key = plan_key(user.pk, dashboard_version(user), today)
+    plan = cache.get(key)
+    if plan is None:
+        plan = plan_for(user, today)
+        cache.set(key, plan, settings.DASHBOARD_CACHE_TIMEOUT)
+    return plan
@@ -0,0 +1,165 @@
+import json
+import logging
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import Template
+
+
+logger = logging.getLogger("habits.profiling")
+
+TOP_STATEMENTS = 3
+
+_current = ContextVar("habits_profile", default=None)
+
+_lock = threading.Lock()
+_window = defaultdict(deque)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = []
+        self.template_time = 0.0
+
+    def record_sql(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.statements.append((sql, time.perf_counter() - started))
+
+    def summary(self, view):
+        total = time.perf_counter() - self.started
+        db = sum(duration for _, duration in self.statements)
+
+        # Statements keep their placeholders, so an N+1 loop shows up as
+        # one SQL string with a high count.
+        counts = Counter(sql for sql, _ in self.statements)
+        slowest = sorted(self.statements, key=lambda s: s[1], reverse=True)
+
+        return {
+            "view": view,
+            "queries": len(self.statements),
+            "db_ms": round(db * 1000, 3),
+            "template_ms": round(self.template_time * 1000, 3),
+            "view_ms": round((total - self.template_time) * 1000, 3),
+            "total_ms": round(total * 1000, 3),
+            "slowest": [
+                {"sql": sql, "ms": round(duration * 1000, 3)}
+                for sql, duration in slowest[:TOP_STATEMENTS]
+            ],
+            "repeated": [
+                {"sql": sql, "count": count}
+                for sql, count in counts.most_common(TOP_STATEMENTS)
+                if count > 1
+            ],
+        }
+
+
+def _timed_render(render):
+    def wrapper(self, *args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return render(self, *args, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            profile.template_time += time.perf_counter() - started
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def server_timing(summary):
+    return ", ".join([
+        f'db;dur={summary["db_ms"]};desc="{summary["queries"]} queries"',
+        f'tpl;dur={summary["template_ms"]}',
+        f'view;dur={summary["view_ms"]}',
+        f'total;dur={summary["total_ms"]}',
+    ])
+
+
+def _remember(summary):
+    now = time.monotonic()
+    cutoff = now - settings.REQUEST_PROFILING_WINDOW
+
+    with _lock:
+        samples = _window[summary["view"]]
+        samples.append((now, summary["total_ms"], summary["db_ms"], summary["queries"]))
+        while samples and samples[0][0] < cutoff:
+            samples.popleft()
+
+
+def profiling_report():
+    cutoff = time.monotonic() - settings.REQUEST_PROFILING_WINDOW
+
+    with _lock:
+        windows = {
+            view: [s for s in samples if s[0] >= cutoff]
+            for view, samples in _window.items()
+        }
+
+    views = {}
+    for view, samples in windows.items():
+        if not samples:
+            continue
+        totals = sorted(s[1] for s in samples)
+        views[view] = {
+            "requests": len(samples),
+            "p50_ms": round(statistics.median(totals), 3),
+            "p95_ms": round(totals[min(len(totals) - 1, int(len(totals) * 0.95))], 3),
+            "mean_db_ms": round(statistics.fmean(s[2] for s in samples), 3),
+            "mean_queries": round(statistics.fmean(s[3] for s in samples), 1),
+            "max_queries": max(s[3] for s in samples),
+        }
+
+    return {
+        "enabled": settings.REQUEST_PROFILING,
+        "window_s": settings.REQUEST_PROFILING_WINDOW,
+        "views": views,
+    }
+
+
+class ProfilingMiddleware:
+    # Opt-in with REQUEST_PROFILING = True. When off, Django drops the
+    # middleware at startup, so requests do not pass through it at all.
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+
+        if not getattr(Template.render, "profiled", False):
+            Template.render = _timed_render(Template.render)
+
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.record_sql))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        match = request.resolver_match
+        summary = profile.summary(match.view_name if match else request.path)
+
+        response["Server-Timing"] = server_timing(summary)
+        logger.info(json.dumps(summary))
+        _remember(summary)
+
+        return response
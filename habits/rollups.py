@@ -0,0 +1,110 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Case, Count, F, Sum, Value, When
+
+from .models import HabitCompletion, UserDailyScore
+
+
+def increment_daily_scores(rows, days, sign):
+    # One CASE update moves every day of {date: (score, completions, load)}
+    def per_day(index, field):
+        return Case(
+            *[When(date=day, then=Value(sign * totals[index])) for day, totals in days.items()],
+            default=Value(0),
+            output_field=UserDailyScore._meta.get_field(field),
+        )
+
+    rows.update(
+        score=F("score") + per_day(0, "score"),
+        completions=F("completions") + per_day(1, "completions"),
+        load=F("load") + per_day(2, "load"),
+    )
+
+
+def add_daily_scores(user_id, days):
+    # {date: (score, completions, load)} added onto the user's rollup rows.
+    # Same shape as add_loads: create missing rows empty, then one CASE
+    # update increments every day at once.
+    if not days:
+        return
+
+    UserDailyScore.objects.bulk_create(
+        [UserDailyScore(user_id=user_id, date=day) for day in days],
+        ignore_conflicts=True,
+    )
+    increment_daily_scores(UserDailyScore.objects.filter(user_id=user_id, date__in=days), days, 1)
+
+
+def completion_totals(completions):
+    # {user_id: {date: (score, completions, load)}} of the completions in
+    # the rollups, as recorded on each
+    rows = (
+        completions
+        .values("habit__user_id", "date")
+        .annotate(total=Sum("score"), count=Count("pk"), cost=Sum("load"))
+        .order_by()
+    )
+    totals = defaultdict(dict)
+    for row in rows.iterator():
+        totals[row["habit__user_id"]][row["date"]] = (row["total"], row["count"], row["cost"])
+    return totals
+
+
+def remove_daily_scores(totals):
+    # Takes completion_totals() back off the rollups, for completions
+    # about to be deleted or moved to another user. Only their own days
+    # change, and a day left without completions loses its row, as a
+    # rebuild would leave it.
+    for user_id, days in totals.items():
+        rows = UserDailyScore.objects.filter(user_id=user_id, date__in=days)
+        increment_daily_scores(rows, days, -1)
+        rows.filter(completions=0).delete()
+
+
+def rebuild_daily_scores(user_ids, days=None):
+    # Every completion counts at what it was recorded as worth, so a
+    # rebuild leaves past days as they were whatever the habits have
+    # become since. With days, only those days' rows are rebuilt.
+    user_ids = list(user_ids)
+    completions = HabitCompletion.objects.filter(habit__user_id__in=user_ids)
+    scores = UserDailyScore.objects.filter(user_id__in=user_ids)
+    if days is not None:
+        completions = completions.filter(date__in=days)
+        scores = scores.filter(date__in=days)
+
+    rows = (
+        completions
+        .values("habit__user_id", "date")
+        .annotate(total=Sum("score"), count=Count("pk"), cost=Sum("load"))
+        .order_by()
+    )
+
+    scores.delete()
+    UserDailyScore.objects.bulk_create(
+        (
+            UserDailyScore(
+                user_id=row["habit__user_id"],
+                date=row["date"],
+                score=row["total"],
+                completions=row["count"],
+                load=row["cost"],
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=500,
+    )
+
+
+def score_range(user, start, end):
+    # One range scan; days without a row are zero
+    rows = dict(
+        UserDailyScore.objects
+        .filter(user=user, date__range=(start, end))
+        .values_list("date", "score")
+    )
+
+    return [
+        (start + timedelta(days=i), rows.get(start + timedelta(days=i), 0))
+        for i in range((end - start).days + 1)
+    ]
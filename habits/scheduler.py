@@ -0,0 +1,193 @@
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import F
+
+from .models import HabitCompletion, JobCheckpoint, UserDailyScore, UserProfile
+from .momentum import decay_all
+from .planner import plan_all, plan_key
+from .rollups import rebuild_daily_scores
+from .sharding import current_db, shard_aliases, use_shard
+from .snapshots import bump_dashboard, shared_cache, snapshot_key
+
+
+CHUNK_SIZE = 1000
+KEEP_CHECKPOINTS_DAYS = 7
+
+# name -> fn(day, users), run in registration order. users is a range of
+# user ids on the current shard; fn returns how many rows it processed and
+# must be safe to rerun for the same day, since a chunk that crashed
+# before its checkpoint is run again.
+JOBS = {}
+
+# Jobs that only write to the cache. They run in worker processes, so
+# with a per-process backend nobody would ever read what they wrote:
+# they are skipped unless the backend is shared.
+CACHE_JOBS = set()
+
+
+def daily_job(name, cache_only=False):
+    def register(fn):
+        JOBS[name] = fn
+        if cache_only:
+            CACHE_JOBS.add(name)
+        return fn
+    return register
+
+
+def _profiles(users):
+    return UserProfile.objects.filter(user_id__gte=users.start, user_id__lt=users.stop)
+
+
+@daily_job("snapshots", cache_only=True)
+def expire_snapshots(day, users):
+    # Yesterday's dashboards can no longer be served, the date is part of
+    # the key. Runs first, while data_version still matches the last one
+    # built.
+    yesterday = day - timedelta(days=1)
+    versions = list(_profiles(users).values_list("user_id", "data_version"))
+    cache.delete_many([snapshot_key(pk, version, yesterday) for pk, version in versions])
+    return len(versions)
+
+
+@daily_job("decay")
+def decay(day, users):
+    # Momentum decay and the difficulty retune that follows from it; the
+    # request path then finds last_decayed already at today
+    return decay_all(day, users=users)["processed"]
+
+
+@daily_job("rollup")
+def rollup(day, users):
+    # Yesterday is closed. Its rollup rows are kept up by every write and
+    # hold what each habit was worth when it was done, so they are left
+    # alone: only users with completions yesterday and no row are rebuilt.
+    yesterday = day - timedelta(days=1)
+    user_ids = set(
+        HabitCompletion.objects
+        .filter(date=yesterday, habit__user_id__gte=users.start, habit__user_id__lt=users.stop)
+        .values_list("habit__user_id", flat=True)
+    )
+    user_ids -= set(
+        UserDailyScore.objects
+        .filter(date=yesterday, user_id__in=user_ids)
+        .values_list("user_id", flat=True)
+    )
+    with transaction.atomic(using=current_db()):
+        rebuild_daily_scores(user_ids, days=[yesterday])
+        bump_dashboard(*user_ids)
+    return len(user_ids)
+
+
+@daily_job("plans", cache_only=True)
+def plans(day, users):
+    # Today's plans, so the first plan request of the day is a cache hit.
+    # Versions are read first: a write racing the solve bumps past them,
+    # and the plan it made stale is left under a key nobody asks for.
+    versions = dict(_profiles(users).values_list("user_id", "data_version"))
+    planned = plan_all(day, users)
+    cache.set_many(
+        {
+            plan_key(pk, versions[pk], day): plan
+            for pk, plan in planned.items() if pk in versions
+        },
+        settings.DASHBOARD_CACHE_TIMEOUT,
+    )
+    return len(planned)
+
+
+def user_chunks(chunk_size=CHUNK_SIZE):
+    # (shard, first_user, stop_user) for every fixed-width id range that
+    # holds users. Fixed ranges keep the same boundaries when users sign
+    # up between a crash and the resume.
+    chunks = []
+    for alias in shard_aliases():
+        buckets = (
+            UserProfile.objects.using(alias)
+            .annotate(bucket=F("user_id") / chunk_size)
+            .values_list("bucket", flat=True)
+            .distinct()
+            .order_by("bucket")
+        )
+        chunks.extend(
+            (alias, bucket * chunk_size, (bucket + 1) * chunk_size) for bucket in buckets
+        )
+    return chunks
+
+
+def run_chunk(name, shard, first_user, stop_user, day):
+    # Runs in a worker process
+    started = time.perf_counter()
+    try:
+        with use_shard(shard):
+            processed = JOBS[name](day, range(first_user, stop_user))
+    finally:
+        connections.close_all()
+    return processed, time.perf_counter() - started
+
+
+def run_daily_jobs(day, workers=None, chunk_size=CHUNK_SIZE, jobs=None):
+    # Each job's chunks run in parallel, the jobs themselves one after the
+    # other. A job with failed chunks stops the run; a rerun for the same
+    # day skips every chunk already checkpointed.
+    JobCheckpoint.objects.filter(day__lt=day - timedelta(days=KEEP_CHECKPOINTS_DAYS)).delete()
+    chunks = user_chunks(chunk_size)
+    report = {}
+
+    # Forked workers must not share the parent's open connections
+    connections.close_all()
+    with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+        for name in jobs or JOBS:
+            if name in CACHE_JOBS and not shared_cache():
+                report[name] = {
+                    "chunks": 0, "resumed": 0, "processed": 0, "seconds": 0.0, "per_second": 0.0,
+                    "errors": [], "skipped": "the cache backend is not shared between processes",
+                }
+                continue
+
+            done = set(
+                JobCheckpoint.objects
+                .filter(job=name, day=day)
+                .values_list("shard", "first_user", "stop_user")
+            )
+            pending = [chunk for chunk in chunks if chunk not in done]
+
+            started = time.perf_counter()
+            futures = {pool.submit(run_chunk, name, *chunk, day): chunk for chunk in pending}
+            processed, errors = 0, []
+            for future in as_completed(futures):
+                shard, first_user, stop_user = futures[future]
+                try:
+                    count, seconds = future.result()
+                except Exception:
+                    errors.append(
+                        f"{shard} [{first_user}, {stop_user}): {traceback.format_exc()}"
+                    )
+                    continue
+
+                JobCheckpoint.objects.create(
+                    job=name, day=day, shard=shard, first_user=first_user, stop_user=stop_user,
+                    processed=count, seconds=seconds,
+                )
+                processed += count
+            elapsed = time.perf_counter() - started
+
+            report[name] = {
+                "chunks": len(pending),
+                "resumed": len(chunks) - len(pending),
+                "processed": processed,
+                "seconds": round(elapsed, 3),
+                "per_second": round(processed / elapsed, 1) if elapsed else 0.0,
+                "errors": errors,
+                "skipped": None,
+            }
+            if errors:
+                break
+
+    return report
@@ -0,0 +1,34 @@
+from django.db.models import Case, F, FloatField, IntegerField, Q, Value, When
+
+
+PRIORITY_MULTIPLIERS = {"low": 1, "medium": 2, "high": 3}
+DIFFICULTY_MULTIPLIERS = {"easy": 0.8, "normal": 1.0, "hard": 1.3}
+DIFFICULTY_LOAD = {"easy": 1, "normal": 2, "hard": 3}
+
+BURNOUT_LOAD = 6
+BURNOUT_MOMENTUM = 70
+
+
+def lookup(field, table, default, output_field):
+    # The SQL side of table.get(value, default)
+    return Case(
+        *[When(**{field: key}, then=Value(value)) for key, value in table.items()],
+        default=Value(default),
+        output_field=output_field,
+    )
+
+
+# Same arithmetic, in the same order, as Habit.discipline_score() and
+# Habit.load_cost(), so the stored columns match the Python values.
+SCORE_EXPRESSION = (
+    F("weight")
+    * lookup("priority", PRIORITY_MULTIPLIERS, 1, IntegerField())
+    * lookup("difficulty", DIFFICULTY_MULTIPLIERS, 1.0, FloatField())
+)
+
+LOAD_EXPRESSION = (
+    lookup("difficulty", DIFFICULTY_LOAD, 2, IntegerField())
+    * lookup("priority", PRIORITY_MULTIPLIERS, 1, IntegerField())
+)
+
+BURNOUT = Q(load__gte=BURNOUT_LOAD, momentum__gte=BURNOUT_MOMENTUM)
@@ -0,0 +1,399 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import transaction
+from django.db.models import F, Max
+from django.db.models.signals import pre_delete
+from django.http import HttpResponse
+from django.dispatch import receiver
+
+
+# Per-user rows live on the user's shard. Auth, sessions, admin and the
+# UserShard directory stay on default, which also keeps (empty) copies of
+# the sharded tables: deleting a User cascades there without failing, and
+# users placed before sharding was turned on keep their rows there until
+# rebalance_shards moves them.
+SHARDED_MODELS = {
+    "userprofile", "habit", "habitcompletion", "completionbitmap", "dailyload", "userdailyscore",
+    "completionevent",
+}
+
+_active = ContextVar("habits_shard", default=None)
+
+
+def shard_key(user_id):
+    return f"habits:shard:{user_id}"
+
+
+def cache_placement():
+    # Placement is only cached where every process sees the same entries.
+    # A per-process copy would go on routing a moved user to the shard
+    # they left, so with one the directory is read every time.
+    from .snapshots import shared_cache
+
+    return shared_cache()
+
+
+def placement(user_id):
+    # (alias, moving). A user being moved is never cached, so the
+    # directory is read until the move is over.
+    if not settings.HABIT_SHARDS:
+        return "default", False
+
+    alias = cache.get(shard_key(user_id)) if cache_placement() else None
+    if alias is not None:
+        return alias, False
+
+    from .models import UserShard
+
+    alias, moving = (
+        UserShard.objects.filter(user_id=user_id).values_list("alias", "moving").first()
+        or ("default", False)
+    )
+    if cache_placement() and not moving:
+        cache.set(shard_key(user_id), alias, settings.SHARD_CACHE_TIMEOUT)
+    return alias, moving
+
+
+def shard_for(user_id):
+    return placement(user_id)[0]
+
+
+def by_shard(user_ids):
+    # {alias: [user_id, ...]}, reading the directory only for users not
+    # in the cache
+    from .models import UserShard
+
+    user_ids = list(user_ids)
+    if not settings.HABIT_SHARDS:
+        return {"default": user_ids} if user_ids else {}
+
+    cached = cache.get_many([shard_key(user_id) for user_id in user_ids]) if cache_placement() else {}
+    placed = {user_id: cached.get(shard_key(user_id)) for user_id in user_ids}
+    missing = [user_id for user_id, alias in placed.items() if alias is None]
+    for start in range(0, len(missing), 500):
+        found = dict(
+            UserShard.objects
+            .filter(user_id__in=missing[start:start + 500])
+            .values_list("user_id", "alias")
+        )
+        for user_id in missing[start:start + 500]:
+            placed[user_id] = found.get(user_id, "default")
+        if cache_placement():
+            cache.set_many(
+                {shard_key(user_id): placed[user_id] for user_id in missing[start:start + 500]},
+                settings.SHARD_CACHE_TIMEOUT,
+            )
+
+    groups = defaultdict(list)
+    for user_id in user_ids:
+        groups[placed[user_id]].append(user_id)
+    return dict(groups)
+
+
+def place_user(user_id):
+    # New users go round-robin over HABIT_SHARDS. The choice is recorded,
+    # so adding a shard later only changes where new users go.
+    from .models import UserShard
+
+    shards = settings.HABIT_SHARDS
+    if not shards:
+        return "default"
+
+    alias = shards[user_id % len(shards)]
+    UserShard.objects.update_or_create(user_id=user_id, defaults={"alias": alias})
+    if cache_placement():
+        cache.set(shard_key(user_id), alias, settings.SHARD_CACHE_TIMEOUT)
+    return alias
+
+
+def allocate_habit_ids(count):
+    # Habit ids come from one sequence on default instead of each shard's
+    # autoincrement, so they are unique across shards and a habit keeps
+    # its id when its user moves: offline clients queue taps by habit id.
+    from .models import Habit, HabitSequence
+
+    sequence = HabitSequence.objects.using("default")
+    with transaction.atomic(using="default"):
+        if not sequence.filter(pk=1).update(last=F("last") + count):
+            # First allocation: after every id already taken on any shard
+            taken = max(
+                Habit.objects.using(alias).aggregate(last=Max("pk"))["last"] or 0
+                for alias in shard_aliases()
+            )
+            sequence.get_or_create(pk=1, defaults={"last": taken})
+            sequence.filter(pk=1).update(last=F("last") + count)
+        last = sequence.values_list("last", flat=True).get(pk=1)
+    return list(range(last - count + 1, last + 1))
+
+
+def shard_aliases():
+    # Every database that can hold per-user rows
+    shards = list(settings.HABIT_SHARDS)
+    return shards if "default" in shards else ["default", *shards]
+
+
+def current_db():
+    return _active.get() or "default"
+
+
+@contextmanager
+def use_shard(alias):
+    # Sharded queries without a more specific hint go to alias
+    token = _active.set(alias)
+    try:
+        yield alias
+    finally:
+        _active.reset(token)
+
+
+@contextmanager
+def user_shard(user_id):
+    with use_shard(shard_for(user_id)) as alias:
+        yield alias
+
+
+def each_shard(username=None):
+    # For management commands: runs the loop body once per shard with its
+    # queries routed there, or only on the given user's shard. Yields that
+    # user's id, or None for "every user".
+    if username is None:
+        for alias in shard_aliases():
+            with use_shard(alias):
+                yield None
+        return
+
+    user_id = User.objects.filter(username=username).values_list("pk", flat=True).first()
+    if user_id is not None:
+        with user_shard(user_id):
+            yield user_id
+
+
+def is_sharded(model):
+    return model._meta.app_label == "habits" and model._meta.model_name in SHARDED_MODELS
+
+
+class ShardRouter:
+    # Does nothing while HABIT_SHARDS is empty
+
+    def _db(self, model, instance=None):
+        if not settings.HABIT_SHARDS:
+            return None
+        if not is_sharded(model):
+            # Also for habit.user and friends, which would otherwise be
+            # read from the habit's database
+            return "default"
+
+        if isinstance(instance, User):
+            # Related managers, e.g. request.user.habits
+            return shard_for(instance.pk)
+        if instance is not None and is_sharded(instance):
+            if instance._state.db:
+                return instance._state.db
+            if getattr(instance, "user_id", None):
+                return shard_for(instance.user_id)
+
+        return _active.get()
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints.get("instance"))
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints.get("instance"))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The user foreign keys cross databases, they have no DB constraint
+        if settings.HABIT_SHARDS and (is_sharded(obj1) or is_sharded(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not settings.HABIT_SHARDS:
+            return None
+        if app_label == "habits" and model_name in SHARDED_MODELS:
+            return db in shard_aliases()
+        return db == "default"
+
+
+class ShardMiddleware:
+    # Routes the request's queries to the signed-in user's shard. Goes
+    # after AuthenticationMiddleware; removed at startup when HABIT_SHARDS
+    # is empty.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.HABIT_SHARDS:
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if not request.user.is_authenticated:
+            return self.get_response(request)
+        alias, moving = placement(request.user.pk)
+        if moving:
+            return moving_response()
+        with use_shard(alias):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return await self.get_response(request)
+        alias, moving = await sync_to_async(placement)(user.pk)
+        if moving:
+            return moving_response()
+        with use_shard(alias):
+            return await self.get_response(request)
+
+
+def moving_response():
+    # The user's rows are between shards: anything written now could land
+    # on the one being emptied. Moves take seconds, so clients just retry.
+    response = HttpResponse("Your data is being moved, try again in a moment.", status=503)
+    response["Retry-After"] = "5"
+    return response
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_rows(sender, instance, **kwargs):
+    # The cascade from auth only reaches default's tables
+    from .models import DailyLoad, Habit, UserDailyScore, UserProfile
+
+    alias = shard_for(instance.pk)
+    if alias == "default":
+        return
+
+    with transaction.atomic(using=alias):
+        for model in (Habit, UserProfile, DailyLoad, UserDailyScore):
+            model.objects.using(alias).filter(user_id=instance.pk).delete()
+    cache.delete(shard_key(instance.pk))
+
+
+def move_user(user_id, target):
+    # Copies every per-user row to target, then deletes the originals.
+    # Habits keep their ids, see allocate_habit_ids(); only one whose id
+    # target already holds, from before ids were allocated, gets a new
+    # one. Completions and bitmaps get new row ids and follow their
+    # habit. Returns the number of habits moved.
+    from .models import (
+        CompletionBitmap, DailyLoad, Habit, HabitCompletion, UserDailyScore, UserProfile, UserShard,
+    )
+    from .writebehind import flush_batch
+
+    source = shard_for(user_id)
+    if source == target:
+        return 0
+
+    # Requests are turned away from here on, see ShardMiddleware
+    UserShard.objects.update_or_create(user_id=user_id, defaults={"alias": source, "moving": True})
+    cache.delete(shard_key(user_id))
+
+    def copies(queryset, habit_ids=None):
+        for obj in queryset.using(source).iterator(chunk_size=2000):
+            obj.pk = None
+            obj._state.adding = True
+            if habit_ids is not None:
+                obj.habit_id = habit_ids[obj.habit_id]
+            yield obj
+
+    try:
+        with transaction.atomic(using=source), transaction.atomic(using=target):
+            # Writing first takes the source's write lock: writes already
+            # under way commit before the copy reads anything, later ones
+            # wait for the move. The version bump also retires cached
+            # snapshots, and moves with the profile.
+            UserProfile.objects.using(source).filter(user_id=user_id).update(
+                data_version=F("data_version") + 1
+            )
+            # Queued taps are applied on source rather than moved
+            with use_shard(source):
+                while flush_batch(user=user_id):
+                    pass
+
+            habits = list(Habit.objects.using(source).filter(user_id=user_id).order_by("pk"))
+            taken = set(
+                Habit.objects.using(target)
+                .filter(pk__in=[habit.pk for habit in habits])
+                .values_list("pk", flat=True)
+            )
+            habit_ids = {}
+            for habit in habits:
+                old = habit.pk
+                habit._state.adding = True
+                if old in taken:
+                    habit.pk = None
+                    habit.save(using=target)
+                else:
+                    habit.save(using=target, force_insert=True)
+                habit_ids[old] = habit.pk
+
+            for model in (UserProfile, DailyLoad, UserDailyScore):
+                model.objects.using(target).bulk_create(
+                    copies(model.objects.filter(user_id=user_id)), batch_size=1000
+                )
+            for model in (HabitCompletion, CompletionBitmap):
+                model.objects.using(target).bulk_create(
+                    copies(model.objects.filter(habit_id__in=habit_ids), habit_ids),
+                    batch_size=1000,
+                )
+
+            # Completions and bitmaps go with their habits
+            for model in (Habit, UserProfile, DailyLoad, UserDailyScore):
+                model.objects.using(source).filter(user_id=user_id).delete()
+
+        # Only once both shards have committed. Placement is only cached in
+        # a shared backend, so every process routes to target from here on.
+        UserShard.objects.filter(user_id=user_id).update(alias=target, moving=False)
+    except BaseException:
+        UserShard.objects.filter(user_id=user_id).update(moving=False)
+        raise
+    finally:
+        cache.delete(shard_key(user_id))
+    return len(habits)
+
+
+def rebalance_plan():
+    # {user_id: target} that evens out users per shard. Users on default
+    # or on a database no longer in HABIT_SHARDS are placed first.
+    from .models import UserShard
+
+    shards = list(settings.HABIT_SHARDS)
+    placed = dict(UserShard.objects.values_list("user_id", "alias"))
+    members = {alias: [] for alias in shards}
+    plan = {}
+
+    for user_id in User.objects.order_by("pk").values_list("pk", flat=True):
+        alias = placed.get(user_id, "default")
+        if alias in members:
+            members[alias].append(user_id)
+        else:
+            target = min(members, key=lambda a: len(members[a]))
+            members[target].append(user_id)
+            plan[user_id] = target
+
+    while True:
+        fullest = max(members, key=lambda a: len(members[a]))
+        emptiest = min(members, key=lambda a: len(members[a]))
+        if len(members[fullest]) - len(members[emptiest]) <= 1:
+            break
+        user_id = members[fullest].pop()
+        members[emptiest].append(user_id)
+        plan[user_id] = emptiest
+
+    return {
+        user_id: target for user_id, target in plan.items()
+        if target != placed.get(user_id, "default")
+    }
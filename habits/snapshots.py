@@ -0,0 +1,128 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from .models import UserProfile
+from .sharding import by_shard, shard_aliases
+
+
+HITS_KEY = "habits:dashboard:hits"
+MISSES_KEY = "habits:dashboard:misses"
+
+# Backends that keep entries inside one process, or nowhere: what another
+# process writes to them is never seen here
+LOCAL_CACHES = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+def shared_cache():
+    return settings.CACHES["default"]["BACKEND"] not in LOCAL_CACHES
+
+
+def dashboard_version(user):
+    version = (
+        UserProfile.objects
+        .filter(user=user)
+        .values_list("data_version", flat=True)
+        .first()
+    )
+    return version or 0
+
+
+# Every write that can change what the dashboard shows must call one of
+# these; the next load then misses the cache and rebuilds.
+def bump_dashboard(*user_ids):
+    for alias, ids in by_shard(user_ids).items():
+        UserProfile.objects.using(alias).filter(user_id__in=ids).update(
+            data_version=F("data_version") + 1
+        )
+
+
+def bump_all_dashboards():
+    for alias in shard_aliases():
+        UserProfile.objects.using(alias).update(data_version=F("data_version") + 1)
+
+
+def snapshot_key(user_id, version, today):
+    # The date is part of the key so the day rollover invalidates
+    # streaks, missed days and the 7-day window without a write.
+    return f"habits:dashboard:{user_id}:{version}:{today.isoformat()}"
+
+
+def dashboard_etag(user, today, queued=None):
+    # Strong: the version changes on every write the snapshot depends on,
+    # and the date covers the rollover, so equal tags mean equal bodies.
+    # queued is the newest write-behind tap not applied yet, if any.
+    tag = f"{user.pk}.{dashboard_version(user)}.{today.isoformat()}"
+    if queued is not None:
+        tag += f".q{queued}"
+    return f'"{tag}"'
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+async def _acount(key):
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        await cache.aadd(key, 0, timeout=None)
+        await cache.aincr(key)
+
+
+def cached_dashboard(user, today, build):
+    key = snapshot_key(user.pk, dashboard_version(user), today)
+
+    snapshot = cache.get(key)
+    if snapshot is not None:
+        _count(HITS_KEY)
+        return snapshot
+
+    _count(MISSES_KEY)
+    snapshot = build(user, today)
+    cache.set(key, snapshot, settings.DASHBOARD_CACHE_TIMEOUT)
+    return snapshot
+
+
+async def adashboard_version(user):
+    version = await (
+        UserProfile.objects
+        .filter(user=user)
+        .values_list("data_version", flat=True)
+        .afirst()
+    )
+    return version or 0
+
+
+async def acached_dashboard(user, today, build):
+    # cached_dashboard() for async views; build is a coroutine function
+    key = snapshot_key(user.pk, await adashboard_version(user), today)
+
+    snapshot = await cache.aget(key)
+    if snapshot is not None:
+        await _acount(HITS_KEY)
+        return snapshot
+
+    await _acount(MISSES_KEY)
+    snapshot = await build(user, today)
+    await cache.aset(key, snapshot, settings.DASHBOARD_CACHE_TIMEOUT)
+    return snapshot
+
+
+def cache_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 3) if total else 0.0,
+    }
@@ -0,0 +1,94 @@
+from collections import namedtuple
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .memo import forget_derived
+
+
+# run/last describe the most recent island regardless of today;
+# current/start are only set when that island ends today.
+StreakStats = namedtuple(
+    "StreakStats", ["current", "longest", "start", "run", "last", "count"]
+)
+
+NO_STREAK = StreakStats(current=0, longest=0, start=None, run=0, last=None, count=0)
+
+STATS_FIELDS = ["streak_length", "longest_streak", "last_completed", "completion_count"]
+
+
+# Rows are (habit_id, date) ordered by habit then date. Consecutive dates
+# form one island; the current streak is the island that ends today.
+def fold_islands(rows, today):
+    stats = {}
+    habit_id = None
+    run_start = prev = None
+    run = longest = count = 0
+
+    def close():
+        if habit_id is None:
+            return
+        best = max(longest, run)
+        if prev == today:
+            stats[habit_id] = StreakStats(run, best, run_start, run, prev, count)
+        else:
+            stats[habit_id] = StreakStats(0, best, None, run, prev, count)
+
+    for pk, day in rows:
+        if pk != habit_id:
+            close()
+            habit_id, run_start, prev = pk, day, day
+            run, longest, count = 1, 0, 1
+            continue
+
+        count += 1
+        if day == prev + timedelta(days=1):
+            run += 1
+        else:
+            longest = max(longest, run)
+            run_start, run = day, 1
+        prev = day
+
+    close()
+    return stats
+
+
+def streak_stats(habit_ids, today=None):
+    from .models import HabitCompletion
+
+    today = today or timezone.now().date()
+    habit_ids = list(habit_ids)
+
+    rows = (
+        HabitCompletion.objects
+        .filter(habit_id__in=habit_ids, date__lte=today)
+        .order_by("habit_id", "date")
+        .values_list("habit_id", "date")
+    )
+
+    stats = fold_islands(rows.iterator(), today)
+    return {pk: stats.get(pk, NO_STREAK) for pk in habit_ids}
+
+
+def apply_stats(habit, stats):
+    habit.streak_length = stats.run
+    habit.longest_streak = stats.longest
+    habit.last_completed = stats.last
+    habit.completion_count = stats.count
+    forget_derived(habit)
+
+
+def refresh_habit_stats(habit_ids, today=None):
+    from .models import Habit
+
+    stats = streak_stats(habit_ids, today)
+
+    habits = []
+    for pk, s in stats.items():
+        habit = Habit(pk=pk)
+        apply_stats(habit, s)
+        habits.append(habit)
+
+    Habit.objects.bulk_update(habits, STATS_FIELDS, batch_size=500)
+
+    return stats
@@ -1,3 +1,688 @@
-from django.test import TestCase
+import io
+import json
+import multiprocessing
+import random
+import re
+import threading
+from contextlib import ExitStack
+from datetime import date, timedelta
+from itertools import combinations
+from types import SimpleNamespace
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .admin import HabitAdmin, HabitCompletionAdmin
+from .benchmark import temporary_shards
+from .bitmaps import YEAR_BYTES, load_histories, mark_days, rebuild_bitmaps
+from .completions import COMPLETED, DUPLICATE, OVER_CAP, complete_habit
+from .consistency import Consistency, habit_consistency
+from .dashboard import build_dashboard
+from .imports import HistoryImporter, read_rows
+from .load import today_load
+from .momentum import decay_all, np, replay_habits, replay_loop, replay_matrix
+from .models import (
+    DEFAULT_DAILY_LOAD_CAP, CompletionBitmap, CompletionEvent, DailyLoad, Habit, HabitCompletion,
+    UserDailyScore, UserProfile, UserShard,
+)
+from .planner import best_subset, plan_all, plan_for
+from .scheduler import run_daily_jobs
+from .sharding import ShardRouter, by_shard, move_user, shard_for, shard_key, user_shard
+from .snapshots import dashboard_etag
+from .writebehind import enqueue_completion, flush_completions, last_queued
+
+
+class MarkCompleteConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    TAPS_PER_HABIT = 4
+
+    def setUp(self):
+        self.user = User.objects.create_user("stress", password="x")
+        self.today = timezone.now().date()
+
+    def fire(self, habit_ids, cap):
+        start = threading.Barrier(len(habit_ids))
+        results = []
+        lock = threading.Lock()
+
+        def worker(habit_id):
+            start.wait()
+            try:
+                result = complete_habit(self.user, habit_id, self.today, cap)
+                with lock:
+                    results.append((habit_id, result))
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(pk,)) for pk in habit_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def test_parallel_taps_gain_momentum_once_per_habit(self):
+        habits = [
+            Habit.objects.create(user=self.user, name=f"habit {i}", weight=3)
+            for i in range(self.THREADS // self.TAPS_PER_HABIT)
+        ]
+        taps = [habit.pk for habit in habits for _ in range(self.TAPS_PER_HABIT)]
+
+        results = self.fire(taps, cap=100)
+
+        self.assertEqual(len(results), len(taps))
+        self.assertEqual(sum(r == COMPLETED for _, r in results), len(habits))
+        self.assertEqual(sum(r == DUPLICATE for _, r in results), len(taps) - len(habits))
+
+        for habit in Habit.objects.filter(user=self.user):
+            # weight 3 * low priority 1 * normal difficulty 1.0
+            self.assertEqual(habit.momentum, 3.0)
+            self.assertEqual(habit.completion_count, 1)
+            self.assertEqual(habit.streak_length, 1)
+            self.assertEqual(habit.last_activity, self.today)
+
+        self.assertEqual(HabitCompletion.objects.count(), len(habits))
+        self.assertEqual(today_load(self.user, self.today), 2 * len(habits))
+
+    def test_parallel_completions_never_exceed_load_cap(self):
+        habits = [
+            Habit.objects.create(user=self.user, name=f"habit {i}", weight=2)
+            for i in range(self.THREADS)
+        ]
+
+        # Each normal/low habit costs 2, so only three fit under a cap of 7
+        results = self.fire([habit.pk for habit in habits], cap=7)
+
+        completed = {pk for pk, r in results if r == COMPLETED}
+        self.assertEqual(len(completed), 3)
+        self.assertEqual(sum(r == OVER_CAP for _, r in results), self.THREADS - 3)
+        self.assertEqual(today_load(self.user, self.today), 6)
+        self.assertEqual(
+            set(HabitCompletion.objects.values_list("habit_id", flat=True)), completed
+        )
+
+        for habit in Habit.objects.filter(user=self.user):
+            expected = 2.0 if habit.pk in completed else 0.0
+            self.assertEqual(habit.momentum, expected)
+
+    def test_mark_complete_without_a_profile(self):
+        UserProfile.objects.filter(user=self.user).delete()
+        habit = Habit.objects.create(user=self.user, name="habit", weight=2)
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse("habit_complete", args=[habit.pk]))
+
+        self.assertRedirects(response, reverse("dashboard"), fetch_redirect_response=False)
+        self.assertEqual(today_load(self.user, self.today), 2)
+
+
+class DashboardQueryPlanTests(TestCase):
+    # "SCAN t" with no index is a full table scan; "SCAN t USING INDEX",
+    # "SEARCH" and "SCAN CONSTANT ROW" are fine.
+    FULL_SCAN = re.compile(r"\bSCAN (?!CONSTANT ROW)(\w+)\b(?! USING)")
+
+    def setUp(self):
+        self.user = User.objects.create_user("plans", password="x")
+        self.today = timezone.now().date()
+
+        for i in range(3):
+            habit = Habit.objects.create(user=self.user, name=f"habit {i}", weight=2)
+            for days in range(10):
+                complete_habit(self.user, habit.pk, self.today - timedelta(days=days), 100)
+
+    def test_dashboard_queries_use_indexes(self):
+        with CaptureQueriesContext(connection) as captured:
+            build_dashboard(self.user, self.today)
+
+        self.assertTrue(captured.captured_queries)
+        with connection.cursor() as cursor:
+            for query in captured.captured_queries:
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                plan = [row[-1] for row in cursor.fetchall()]
+                scans = [m.group(1) for line in plan for m in self.FULL_SCAN.finditer(line)]
+                self.assertEqual(scans, [], f"{query['sql']}\n{plan}")
+
+
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        self.today = timezone.now().date()
+
+    def replay(self, username, apply):
+        user = User.objects.create_user(username, password="x")
+        habits = [
+            Habit.objects.create(user=user, name=f"habit {i}", weight=3, priority=priority)
+            for i, priority in enumerate(["low", "medium", "high"])
+        ]
+        # Backfills, a duplicate and taps that only fit after a retune
+        for i, offset in [(0, 5), (1, 5), (0, 4), (0, 4), (2, 4), (0, 0), (1, 0), (2, 0), (0, 1)]:
+            apply(user, habits[i].pk, self.today - timedelta(days=offset))
+        return user
+
+    def state(self, user):
+        return (
+            list(
+                Habit.objects.filter(user=user).order_by("name").values_list(
+                    "momentum", "base_momentum", "difficulty", "streak_length", "longest_streak",
+                    "last_completed", "completion_count", "last_activity", "last_decayed",
+                )
+            ),
+            sorted(HabitCompletion.objects.filter(habit__user=user).values_list("habit__name", "date")),
+            list(DailyLoad.objects.filter(user=user).values_list("date", "load")),
+            list(UserDailyScore.objects.filter(user=user).values_list("date", "score", "completions", "load")),
+        )
+
+    @override_settings(COMPLETION_WRITE_BEHIND=True)
+    def test_conditional_get_does_not_flush(self):
+        user = User.objects.create_user("poller", password="x")
+        habit = Habit.objects.create(user=user, name="habit", weight=3)
+        self.client.force_login(user)
+        api = reverse("dashboard_api")
+        tag = self.client.get(api)["ETag"]
+
+        enqueue_completion(user, habit.pk, self.today)
+        queued = dashboard_etag(user, self.today, last_queued(user))
+        self.assertNotEqual(queued, tag)
+        # A 304 leaves the tap queued
+        self.assertEqual(self.client.get(api, headers={"If-None-Match": queued}).status_code, 304)
+        self.assertTrue(CompletionEvent.objects.exists())
+
+        # The old tag no longer matches; the full response applies the tap
+        response = self.client.get(api, headers={"If-None-Match": tag})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(CompletionEvent.objects.exists())
+        self.assertEqual(response.json()["completed_habits"], [habit.pk])
+        self.assertEqual(self.client.get(api, headers={"If-None-Match": response["ETag"]}).status_code, 304)
+
+    def test_flushed_taps_match_direct_taps(self):
+        direct = self.replay("direct", lambda user, pk, day: complete_habit(user, pk, day, 7))
+        queued = self.replay("queued", lambda user, pk, day: enqueue_completion(user, pk, day))
+        UserProfile.objects.filter(user=queued).update(daily_load_cap=7)
+
+        self.assertEqual(HabitCompletion.objects.filter(habit__user=queued).count(), 0)
+        # Small batches, so one habit's taps span several transactions
+        self.assertEqual(flush_completions(batch_size=4), 9)
+
+        self.assertFalse(CompletionEvent.objects.exists())
+        self.assertEqual(self.state(queued), self.state(direct))
+
+
+class PlannerTests(TestCase):
+    def test_best_subset_matches_brute_force(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            items = [(i, rng.randint(1, 9), rng.uniform(0.5, 40)) for i in range(rng.randint(0, 9))]
+            capacity = rng.randint(0, 20)
+
+            chosen = best_subset(items, capacity)
+            self.assertLessEqual(sum(items[i][1] for i in chosen), capacity)
+            best = max(
+                sum(value for _, _, value in subset)
+                for size in range(len(items) + 1)
+                for subset in combinations(items, size)
+                if sum(cost for _, cost, _ in subset) <= capacity
+            )
+            self.assertAlmostEqual(sum(items[i][2] for i in chosen), best)
+
+    def test_plan_skips_done_habits_and_fits_remaining_cap(self):
+        today = timezone.now().date()
+        user = User.objects.create_user("planner", password="x")
+        done = Habit.objects.create(user=user, name="done", weight=5)
+        # At risk: a 6-day streak ends tonight
+        streak = Habit.objects.create(
+            user=user, name="streak", weight=2, difficulty="hard",
+            streak_length=6, last_completed=today - timedelta(days=1),
+        )
+        heavy = Habit.objects.create(user=user, name="heavy", weight=5, priority="high", difficulty="hard")
+        light = Habit.objects.create(user=user, name="light", weight=1, difficulty="easy")
+        Habit.objects.create(user=user, name="paused", weight=5, difficulty="easy", is_active=False)
+
+        complete_habit(user, done.pk, today, 100)
+
+        # 8 left: heavy (9) never fits, streak (3) and light (1) both do
+        plan = plan_for(user, today)
+        self.assertEqual(plan.capacity, 8)
+        self.assertEqual(plan.habits, [streak.pk, light.pk])
+        self.assertEqual(plan.load, 4)
+        self.assertEqual(plan_all(today)[user.pk], plan)
+        self.assertNotIn(heavy.pk, plan.habits)
+
+    def test_batch_and_single_plans_agree_without_a_profile(self):
+        today = timezone.now().date()
+        user = User.objects.create_user("no-profile", password="x")
+        for i, difficulty in enumerate(["hard", "normal", "hard", "easy", "hard"]):
+            Habit.objects.create(user=user, name=f"habit {i}", weight=i + 1, difficulty=difficulty)
+        UserProfile.objects.filter(user=user).delete()
+
+        plan = plan_for(user, today)
+        self.assertEqual(plan.capacity, DEFAULT_DAILY_LOAD_CAP)
+        self.assertEqual(plan_all(today)[user.pk], plan)
+
+
+class ImportTests(TestCase):
+    def test_bad_lines_are_skipped_not_fatal(self):
+        user = User.objects.create_user("importer", password="x")
+        habit = Habit.objects.create(user=user, name="read", weight=3)
+        HabitCompletion.objects.create(habit=habit, date=timezone.now().date() - timedelta(days=9))
+        day = lambda n: (timezone.now().date() - timedelta(days=n)).isoformat()
+
+        lines = [
+            f'{{"user": "importer", "habit": "read", "date": "{day(10)}"}}',
+            '{"user": "importer", "habit": ',
+            "[1, 2]",
+            "5",
+            f'{{"user": "importer", "habit": "read", "date": "{day(9)}"}}',
+            f'{{"user": "importer", "habit": "run", "date": "{day(8)}"}}',
+            f'{{"user": "importer", "habit": "run", "date": "{day(8)}"}}',
+        ]
+        importer = HistoryImporter(batch_size=2)
+        importer.load(read_rows(io.StringIO("\n".join(lines)), "ndjson"))
+        importer.finish()
+
+        self.assertEqual((importer.rows, importer.skipped, importer.imported), (7, 3, 2))
+        self.assertEqual(
+            sorted(HabitCompletion.objects.filter(habit__user=user).values_list("habit__name", "date")),
+            sorted([
+                ("read", date.fromisoformat(day(10))),
+                ("read", date.fromisoformat(day(9))),
+                ("run", date.fromisoformat(day(8))),
+            ]),
+        )
+
+    def test_imported_habits_date_from_their_history(self):
+        user = User.objects.create_user("importer", password="x")
+        today = timezone.now().date()
+        Habit.objects.create(user=user, name="read", weight=3)
+        lines = [
+            f'{{"user": "importer", "habit": "{name}", "date": "{(today - timedelta(days=n)).isoformat()}"}}'
+            for name, n in [("read", 10), ("run", 8), ("run", 5)]
+        ]
+
+        importer = HistoryImporter()
+        importer.load(read_rows(io.StringIO("\n".join(lines)), "ndjson"))
+        importer.finish()
+
+        habits = Habit.objects.filter(user=user)
+        stats = habit_consistency(habits, today)
+        self.assertEqual(
+            {habit.name: stats[habit.pk] for habit in habits},
+            {"read": Consistency(1, 11), "run": Consistency(2, 9)},
+        )
+
+
+# Worker processes only see the test database if they are forked from
+# this one; a fresh interpreter would open the real one.
+@skipUnless(multiprocessing.get_start_method() == "fork", "needs forked workers")
+class SchedulerTests(TransactionTestCase):
+    def test_rollover_keeps_yesterdays_scores(self):
+        today = timezone.now().date()
+        yesterday = today - timedelta(days=1)
+        user = User.objects.create_user("rollover", password="x")
+        habit = Habit.objects.create(user=user, name="habit", weight=4, priority="high")
+        complete_habit(user, habit.pk, yesterday, 100)
+        # Retuned since: yesterday still counts at what it was worth then
+        Habit.objects.filter(pk=habit.pk).update(difficulty="hard")
+        recorded = list(UserDailyScore.objects.filter(user=user).values_list("date", "score", "load"))
+
+        report = run_daily_jobs(today, workers=2)
+
+        self.assertFalse([name for name, r in report.items() if r["errors"]])
+        # locmem: the workers' cache writes would never reach this process
+        self.assertEqual({name for name, r in report.items() if r["skipped"]}, {"snapshots", "plans"})
+        self.assertEqual(
+            list(UserDailyScore.objects.filter(user=user).values_list("date", "score", "load")),
+            recorded,
+        )
+
+
+class RollupMaintenanceTests(TestCase):
+    def setUp(self):
+        self.today = timezone.now().date()
+        self.user = User.objects.create_user("owner", password="x")
+        self.habits = [
+            Habit.objects.create(user=self.user, name=f"habit {i}", weight=i + 1) for i in range(2)
+        ]
+        for habit in self.habits:
+            for days in range(1, 4):
+                complete_habit(self.user, habit.pk, self.today - timedelta(days=days), 100)
+
+    def rollup(self, user):
+        return [
+            (day, round(score, 6), completions, load)
+            for day, score, completions, load in UserDailyScore.objects.filter(user=user).values_list(
+                "date", "score", "completions", "load"
+            )
+        ]
+
+    def ledger(self, user):
+        return list(DailyLoad.objects.filter(user=user).order_by("-date").values_list("date", "load"))
+
+    def worth(self, habit):
+        # What the habit's completions were recorded at, one row per day
+        return [
+            (day, round(score, 6), 1, load)
+            for day, score, load in HabitCompletion.objects.filter(habit=habit).values_list(
+                "date", "score", "load"
+            )
+        ]
+
+    def test_deleted_habit_leaves_the_rollups(self):
+        # Retuned since: the habit that stays keeps its past days' worth
+        kept = self.habits[1]
+        Habit.objects.filter(pk=kept.pk).update(difficulty="hard")
+
+        self.client.login(username="owner", password="x")
+        self.client.post(reverse("habit_delete", args=[self.habits[0].pk]))
+
+        self.assertEqual(self.rollup(self.user), self.worth(kept))
+        self.assertEqual(self.ledger(self.user), [(day, load) for day, _, _, load in self.worth(kept)])
+
+    def test_reassigned_habit_moves_its_rollups(self):
+        other = User.objects.create_user("other", password="x")
+        habit, kept = self.habits
+        Habit.objects.filter(pk=kept.pk).update(difficulty="hard")
+        moved = self.worth(habit)
+        habit.user = other
+        habit.difficulty = "easy"
+        request = RequestFactory().post("/")
+        HabitAdmin(Habit, admin.site).save_model(
+            request, habit, SimpleNamespace(initial={"user": self.user.pk}), True
+        )
+
+        self.assertEqual(self.rollup(self.user), self.worth(kept))
+        self.assertEqual(self.rollup(other), moved)
+        self.assertEqual(self.ledger(other), [(day, load) for day, _, _, load in moved])
+
+    def test_admin_deleted_completions_leave_the_ledger(self):
+        day = self.today - timedelta(days=2)
+        kept = self.habits[1]
+        request = RequestFactory().post("/")
+        HabitCompletionAdmin(HabitCompletion, admin.site).delete_queryset(
+            request, HabitCompletion.objects.filter(habit=self.habits[0], date=day)
+        )
+
+        left = HabitCompletion.objects.get(habit=kept, date=day)
+        self.assertIn((day, left.load), self.ledger(self.user))
+        self.assertIn((day, round(left.score, 6), 1, left.load), self.rollup(self.user))
+
+
+SHARDS = ["bench_shard0", "bench_shard1"]
+
+
+@override_settings(HABIT_SHARDS=SHARDS)
+class ShardingTests(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The shards are throwaway databases of their own. They only exist
+        # from here on, so the runner cannot be told about them up front.
+        cls._shards = ExitStack()
+        cls._shards.enter_context(temporary_shards(len(SHARDS)))
+        cls.addClassCleanup(cls._shards.close)
+        cls.databases = {"default", *SHARDS}
+        super().setUpClass()
+
+    def setUp(self):
+        self.today = timezone.now().date()
+        # Placement is round-robin on the user id
+        self.users = [User.objects.create_user(f"sharded{i}", password="x") for i in range(4)]
+
+    def test_by_shard_groups_users_by_directory(self):
+        placed = dict(UserShard.objects.values_list("user_id", "alias"))
+        self.assertEqual(set(placed.values()), set(SHARDS))
+
+        groups = by_shard([user.pk for user in self.users] + [10 ** 6])
+        self.assertEqual(groups.pop("default"), [10 ** 6])
+        self.assertEqual(
+            {alias: set(ids) for alias, ids in groups.items()},
+            {alias: {pk for pk, a in placed.items() if a == alias} for alias in SHARDS},
+        )
+
+    def test_router_sends_user_rows_to_their_shard(self):
+        user = self.users[0]
+        home = shard_for(user.pk)
+        other, = set(SHARDS) - {home}
+        with user_shard(user.pk):
+            habit = Habit.objects.create(user=user, name="habit", weight=2)
+
+        router = ShardRouter()
+        self.assertEqual(habit._state.db, home)
+        self.assertEqual(router.db_for_read(Habit, instance=user), home)
+        self.assertEqual(router.db_for_write(HabitCompletion, instance=habit), home)
+        self.assertEqual(router.db_for_read(User), "default")
+        self.assertEqual(router.db_for_read(UserShard), "default")
+        self.assertEqual(list(user.habits.values_list("pk", flat=True)), [habit.pk])
+        self.assertFalse(Habit.objects.using(other).exists())
+        self.assertTrue(UserProfile.objects.using(home).filter(user=user).exists())
+
+    def test_move_user_takes_every_row_along(self):
+        user = self.users[0]
+        source = shard_for(user.pk)
+        target, = set(SHARDS) - {source}
+        with user_shard(user.pk):
+            habit = Habit.objects.create(user=user, name="habit", weight=2)
+            for days in range(3):
+                complete_habit(user, habit.pk, self.today - timedelta(days=days), 100)
+        # Created on target by another user, so the id would be the same
+        # under per-shard autoincrement
+        with user_shard(self.users[1].pk):
+            Habit.objects.create(user=self.users[1], name="neighbour", weight=2)
+
+        self.assertEqual(move_user(user.pk, target), 1)
+
+        # A worker that looked the user up before the move still has the
+        # old placement in its own cache, which the move cannot clear
+        cache.set(shard_key(user.pk), source)
+        self.assertEqual(shard_for(user.pk), target)
+        for model in (Habit, UserProfile, DailyLoad, UserDailyScore):
+            self.assertFalse(model.objects.using(source).filter(user=user).exists(), model)
+            self.assertTrue(model.objects.using(target).filter(user=user).exists(), model)
+        # Offline clients queue taps by habit id, so it is kept
+        moved = Habit.objects.using(target).get(user=user)
+        self.assertEqual(moved.pk, habit.pk)
+        self.assertEqual(
+            sorted(HabitCompletion.objects.using(target).filter(habit=moved).values_list("date", flat=True)),
+            [self.today - timedelta(days=days) for days in range(2, -1, -1)],
+        )
+        self.assertFalse(HabitCompletion.objects.using(source).exists())
+        self.assertFalse(UserShard.objects.get(user=user).moving)
+
+    def test_requests_wait_out_a_move(self):
+        user = self.users[0]
+        UserShard.objects.filter(user=user).update(moving=True)
+        self.client.force_login(user)
+
+        response = self.client.get(reverse("dashboard"))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+
+
+class BitmapTests(TestCase):
+    # Leap day, both ends of a leap year (bit 365 is the last one the 46
+    # bytes hold) and runs across New Year
+    DAYS = [
+        date(2023, 12, 30), date(2023, 12, 31), date(2024, 1, 1), date(2024, 2, 28),
+        date(2024, 2, 29), date(2024, 3, 1), date(2024, 12, 31), date(2025, 1, 1),
+        date(2025, 1, 2),
+    ]
+
+    def setUp(self):
+        user = User.objects.create_user("bits", password="x")
+        self.habit = Habit.objects.create(user=user, name="habit", weight=1)
+
+    def assert_matches_completions(self):
+        stored = set(HabitCompletion.objects.filter(habit=self.habit).values_list("date", flat=True))
+        history = load_histories(Habit.objects.filter(pk=self.habit.pk))[self.habit.pk]
+
+        day = date(2023, 12, 1)
+        while day <= date(2025, 1, 31):
+            self.assertEqual(history.done(day), day in stored, day)
+            day += timedelta(days=1)
+        for bits in CompletionBitmap.objects.filter(habit=self.habit).values_list("bits", flat=True):
+            self.assertEqual(len(bits), YEAR_BYTES)
+
+    def test_marked_days_round_trip(self):
+        HabitCompletion.objects.bulk_create(HabitCompletion(habit=self.habit, date=day) for day in self.DAYS)
+        # In two writes, so the second one merges into existing year rows
+        mark_days([(self.habit.pk, day) for day in self.DAYS[:4]])
+        mark_days([(self.habit.pk, day) for day in self.DAYS[4:]])
+
+        self.assert_matches_completions()
+
+        # The dashboard loads a single year
+        history = load_histories(Habit.objects.filter(pk=self.habit.pk), 2024)[self.habit.pk]
+        self.assertEqual(
+            [day for day in self.DAYS if history.done(day)],
+            [day for day in self.DAYS if day.year == 2024],
+        )
+
+    def test_cleared_days_round_trip(self):
+        HabitCompletion.objects.bulk_create(HabitCompletion(habit=self.habit, date=day) for day in self.DAYS)
+        rebuild_bitmaps([self.habit.pk])
+        HabitCompletion.objects.filter(
+            habit=self.habit, date__in=[date(2023, 12, 31), date(2024, 2, 29), date(2024, 12, 31)]
+        ).delete()
+        rebuild_bitmaps([self.habit.pk])
+
+        self.assert_matches_completions()
+
+
+@skipUnless(np is not None, "numpy is not installed")
+class ReplayTests(TestCase):
+    def test_matrix_replay_matches_loop(self):
+        rng = random.Random(0)
+        start = date(2024, 1, 1)
+        for _ in range(20):
+            habits = {
+                pk: SimpleNamespace(weight=rng.randint(1, 5), priority=rng.choice(["low", "medium", "high"]))
+                for pk in range(1, rng.randint(2, 30))
+            }
+            rows = sorted(
+                (pk, start + timedelta(days=offset))
+                for pk in habits
+                for offset in rng.sample(range(400), rng.randint(0, 120))
+            )
+
+            loop, matrix = replay_loop(habits, rows), replay_matrix(habits, rows)
+            self.assertEqual(set(matrix), set(loop))
+            for pk, (momentum, difficulty, last_activity) in loop.items():
+                self.assertAlmostEqual(matrix[pk][0], momentum, msg=pk)
+                self.assertEqual(matrix[pk][1:], (difficulty, last_activity), pk)
+
+
+class DecayTests(TestCase):
+    def test_nightly_and_single_runs_agree(self):
+        today = timezone.now().date()
+        start = today - timedelta(days=6)
+        user = User.objects.create_user("decay", password="x")
+        nightly = Habit.objects.create(user=user, name="nightly", weight=4, priority="low")
+        single = Habit.objects.create(user=user, name="single", weight=4, priority="low")
+        HabitCompletion.objects.bulk_create(
+            HabitCompletion(habit=habit, date=day)
+            for habit in (nightly, single)
+            for day in (start, today)
+        )
+        for habit in (nightly, single):
+            habit.gain_momentum(start)
+            habit.auto_tune_difficulty()
+        gained = nightly.momentum
+
+        for offset in range(1, 5):
+            nightly.decay_momentum(start + timedelta(days=offset))
+        decay_all(start + timedelta(days=5))
+        single.refresh_from_db()
+        nightly.refresh_from_db()
+        self.assertAlmostEqual(nightly.momentum, single.momentum)
+        self.assertAlmostEqual(single.momentum, gained * 0.25)
+
+        # The next completion lands where a replay of the history puts it
+        for habit in (nightly, single):
+            habit.decay_momentum(today)
+            habit.gain_momentum(today)
+        replay_habits([nightly.pk, single.pk])
+        for habit in (nightly, single):
+            momentum = habit.momentum
+            habit.refresh_from_db()
+            self.assertAlmostEqual(habit.momentum, momentum)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.today = timezone.now().date()
+        self.user = User.objects.create_user("exporter", password="x")
+        done = Habit.objects.create(user=self.user, name="done", weight=2)
+        Habit.objects.create(user=self.user, name="never", weight=2)
+        for days in range(1, 4):
+            complete_habit(self.user, done.pk, self.today - timedelta(days=days), 100)
+
+    def test_round_trip_keeps_habits_without_completions(self):
+        self.client.force_login(self.user)
+        for fmt in ("csv", "ndjson"):
+            body = b"".join(self.client.get(reverse("habit_export"), {"format": fmt}).streaming_content)
+            Habit.objects.filter(user=self.user).delete()
+
+            importer = HistoryImporter()
+            importer.load(read_rows(io.StringIO(body.decode()), fmt))
+            importer.finish()
+
+            self.assertEqual((importer.skipped, importer.bare, importer.imported), (0, 1, 3), fmt)
+            self.assertEqual(
+                sorted(Habit.objects.filter(user=self.user).values_list("name", "completion_count")),
+                [("done", 3), ("never", 0)],
+                fmt,
+            )
+
+    async def test_asgi_streams_without_buffering(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("habit_export"), {"format": "ndjson", "derived": "1"})
+
+        self.assertTrue(response.is_async)
+        lines = [json.loads(line) async for line in response.streaming_content]
+        self.assertEqual(
+            [(line["habit"], line["date"], line["streak"]) for line in lines],
+            [("done", (self.today - timedelta(days=days)).isoformat(), 4 - days) for days in range(3, 0, -1)]
+            + [("never", None, None)],
+        )
+
+
+class SyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("mobile", password="x")
+        self.habit = Habit.objects.create(user=self.user, name="habit", weight=2)
+        self.day = (timezone.now().date() - timedelta(days=1)).isoformat()
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.force_login(self.user)
+
+    def sync(self, items, **headers):
+        return self.client.post(
+            reverse("habit_sync"), json.dumps({"completions": items}),
+            content_type="application/json", headers=headers,
+        )
+
+    def token(self):
+        # What a client gets from the login page
+        self.client.get(reverse("login"))
+        return self.client.cookies["csrftoken"].value
+
+    def test_requires_csrf_token(self):
+        self.assertEqual(self.sync([{"habit": self.habit.pk, "date": self.day}]).status_code, 403)
+
+        response = self.sync([{"habit": self.habit.pk, "date": self.day}], X_CSRFToken=self.token())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["rejected"], [])
+        self.assertTrue(HabitCompletion.objects.filter(habit=self.habit).exists())
+
+    def test_habit_ids_must_be_integers(self):
+        token = self.token()
+        for habit in [True, float(self.habit.pk) + 0.9, str(self.habit.pk), None]:
+            response = self.sync([{"habit": habit, "date": self.day}], X_CSRFToken=token)
+            self.assertEqual(response.status_code, 400, habit)
+        self.assertFalse(HabitCompletion.objects.exists())
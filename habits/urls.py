@@ -7,5 +7,11 @@ urlpatterns = [
     path('habits/<int:pk>/edit/', views.habit_update, name='habit_update'),
     path('habits/<int:pk>/delete/', views.habit_delete, name='habit_delete'),
     path('habits/<int:pk>/complete/', views.mark_complete, name='habit_complete'),
+    path('habits/sync/', views.sync_completions, name='habit_sync'),
+    path('habits/export/', views.export_history, name='habit_export'),
+    path('api/dashboard/', views.dashboard_api, name='dashboard_api'),
+    path('api/plan/', views.plan_api, name='plan_api'),
+    path('stats/dashboard-cache/', views.dashboard_cache_stats, name='dashboard_cache_stats'),
+    path('stats/profiling/', views.profiling_stats, name='profiling_stats'),
 
 ]
@@ -1,12 +1,5 @@
-def user_consistency_score(habits, days=30):
-    active_habits = habits.filter(is_active=True)
-
-    if not active_habits.exists():
-        return 0
+from .consistency import user_consistency
 
-    scores = [
-        habit.consistency_index(days)
-        for habit in active_habits
-    ]
 
-    return round(sum(scores) / len(scores), 1)
+def user_consistency_score(habits, days=30):
+    return user_consistency(habits, days=days)
@@ -1,83 +1,104 @@
+import json
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
-from datetime import timedelta, date
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.http import condition, require_POST
+from datetime import date
 
-from .models import Habit, HabitCompletion
+from .models import Habit
 from .forms import HabitForm
+from .dashboard import abuild_dashboard, build_dashboard
+from .completions import (
+    SYNC_BATCH_LIMIT,
+    BadSyncItem,
+    apply_synced_completions,
+    complete_habit,
+    parse_sync_items,
+)
+from .export import FORMATS, aexport_lines, export_lines
+from .load import load_cap, rebuild_loads
+from .planner import cached_plan
+from .profiling import profiling_report
+from .rollups import completion_totals, remove_daily_scores
+from .sharding import current_db
+from .writebehind import enqueue_completion, flush_user, last_queued
+from .snapshots import (
+    acached_dashboard,
+    bump_dashboard,
+    cache_stats,
+    cached_dashboard,
+    dashboard_etag,
+)
 
 
 @login_required
-def dashboard(request):
+async def dashboard(request):
     today = date.today()
-    habits = Habit.objects.filter(user=request.user, is_active=True)
-
-    # ---- Prefetch completions (performance fix) ----
-    completions = HabitCompletion.objects.filter(
-        habit__user=request.user,
-        date__gte=today - timedelta(days=6),
-        date__lte=today,
-    )
-
-    completed_map = {(c.habit_id, c.date) for c in completions}
-
-    completed_today = {
-        c.habit_id for c in completions if c.date == today
-    }
-
-    # ---- Total discipline score ----
-    total_score = sum(habit.discipline_score() for habit in habits)
-
-    # ---- Daily scores (single source of truth) ----
-    daily_scores = []
-    for i in range(6, -1, -1):
-        day = today - timedelta(days=i)
-        score = 0
-
-        for habit in habits:
-            if (habit.id, day) in completed_map:
-                score += habit.discipline_score()
-
-        daily_scores.append({
-            "date": day.strftime("%b %d"),
-            "score": score,
-        })
-
-    # ---- Trend ----
-    trend = "stable"
-    if daily_scores[-1]["score"] > daily_scores[0]["score"]:
-        trend = "improving"
-    elif daily_scores[-1]["score"] < daily_scores[0]["score"]:
-        trend = "declining"
-
-    # ---- Burnout detection ----
-    has_burnout_risk = any(
-        habit.burnout_risk() == "high"
-        for habit in habits
-    )
-
-    # ---- Consistency index (30 days) ----
-    total_possible = habits.count() * 30
-    completed_30 = HabitCompletion.objects.filter(
-        habit__user=request.user,
-        date__gte=today - timedelta(days=30),
-    ).count()
-
-    consistency_score = int((completed_30 / total_possible) * 100) if total_possible else 0
-
-    context = {
-        "habits": habits,
-        "completed_habits": completed_today,
-        "daily_scores": daily_scores,
-        "total_score": int(total_score),
-        "trend": trend,
-        "has_burnout_risk": has_burnout_risk,
-        "consistency_score": consistency_score,
-    }
-
+    # The template reads request.user, which would load it synchronously
+    request.user = await request.auser()
+    await sync_to_async(flush_user)(request.user)
+    context = await acached_dashboard(request.user, today, abuild_dashboard)
     return render(request, "habits/dashboard.html", context)
 
 
+def _dashboard_api_etag(request):
+    # Called by condition() before the view, also for a request that ends
+    # in a 304, so it only reads. While taps are queued the tag names the
+    # newest one, and cannot match a tag sent before it was made.
+    if not request.user.is_authenticated:
+        return None
+    return dashboard_etag(request.user, timezone.now().date(), last_queued(request.user))
+
+
+# Clients poll this: a matching If-None-Match costs one version lookup
+# (and one queue lookup with write-behind) and gets a 304 before the
+# snapshot is read or built.
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_dashboard_api_etag)
+def dashboard_api(request):
+    today = timezone.now().date()
+    flush_user(request.user)
+    # Tagged after the flush, which bumps the version, and before the
+    # read, so a write racing the read can only make the tag older
+    etag = dashboard_etag(request.user, today)
+    context = cached_dashboard(request.user, today, build_dashboard)
+    response = JsonResponse({
+        **context,
+        "completed_habits": sorted(context["completed_habits"]),
+    })
+    # condition() only adds its own, pre-flush tag when there is none
+    response["ETag"] = etag
+    return response
+
+
+# The habits worth doing next that still fit under today's load cap
+@login_required
+def plan_api(request):
+    flush_user(request.user)
+    plan = cached_plan(request.user, timezone.now().date())
+    return JsonResponse(plan._asdict())
+
+
+@staff_member_required
+def dashboard_cache_stats(request):
+    return JsonResponse(cache_stats())
+
+
+@staff_member_required
+def profiling_stats(request):
+    return JsonResponse(profiling_report())
+
+
 @login_required
 def habit_create(request):
     if request.method == "POST":
@@ -85,7 +106,10 @@ def habit_create(request):
         if form.is_valid():
             habit = form.save(commit=False)
             habit.user = request.user
-            habit.save()
+            # One write transaction, which takes the lock at BEGIN
+            with transaction.atomic(using=current_db()):
+                habit.save()
+                bump_dashboard(request.user.pk)
             return redirect("dashboard")
     else:
         form = HabitForm()
@@ -100,7 +124,9 @@ def habit_update(request, pk):
     if request.method == "POST":
         form = HabitForm(request.POST, instance=habit)
         if form.is_valid():
-            form.save()
+            with transaction.atomic(using=current_db()):
+                form.save()
+                bump_dashboard(request.user.pk)
             return redirect("dashboard")
     else:
         form = HabitForm(instance=habit)
@@ -113,32 +139,88 @@ def habit_delete(request, pk):
     habit = get_object_or_404(Habit, pk=pk, user=request.user)
 
     if request.method == "POST":
-        habit.delete()
+        with transaction.atomic(using=current_db()):
+            # Its completions leave the daily score rollups and the load
+            # ledger with it
+            totals = completion_totals(habit.completions.all())
+            habit.delete()
+            remove_daily_scores(totals)
+            rebuild_loads(totals, {day for days in totals.values() for day in days})
+            bump_dashboard(request.user.pk)
         return redirect("dashboard")
 
     return render(request, "habits/habit_confirm_delete.html", {"habit": habit})
 
 
 @login_required
-def mark_complete(request, pk):
-    habit = get_object_or_404(Habit, pk=pk, user=request.user)
+async def mark_complete(request, pk):
     today = timezone.now().date()
+    user = await request.auser()
+
+    # Transactions are sync-only, so the completion itself runs in a thread
+    try:
+        if settings.COMPLETION_WRITE_BEHIND:
+            await sync_to_async(enqueue_completion)(user, pk, today)
+        else:
+            # A user without a profile row gets the default cap
+            cap = await sync_to_async(load_cap)(user)
+            await sync_to_async(complete_habit)(user, pk, today, cap)
+    except Habit.DoesNotExist:
+        raise Http404("No Habit matches the given query.")
 
-    profile = request.user.userprofile
-    current_load = today_load(request.user)
+    return redirect("dashboard")
 
-    if current_load + habit.load_cost() > profile.daily_load_cap:
-        # Too much load → decay instead of reward
-        habit.decay_momentum()
-        habit.save()
-        return redirect("dashboard")
 
-    HabitCompletion.objects.get_or_create(habit=habit, date=today)
+# Session-authenticated like every other view, so CSRF stays on even if
+# the middleware is ever dropped. Clients that are not a browser (the
+# mobile apps) sign in through the login form, keep the csrftoken cookie
+# it sets, and send it back in the X-CSRFToken header.
+@csrf_protect
+@login_required
+@require_POST
+def sync_completions(request):
+    try:
+        items = json.loads(request.body)["completions"]
+        if not isinstance(items, list):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": 'Expected {"completions": [{"habit": id, "date": "YYYY-MM-DD"}, ...]}'}, status=400)
+
+    if len(items) > SYNC_BATCH_LIMIT:
+        return JsonResponse({"error": f"At most {SYNC_BATCH_LIMIT} completions per request"}, status=400)
 
-    habit.decay_momentum()
-    habit.gain_momentum()
-    habit.auto_tune_difficulty()
-    habit.save()
+    today = timezone.now().date()
+    try:
+        pairs, rejected = parse_sync_items(items, today)
+    except BadSyncItem as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
-    return redirect("dashboard")
+    result = apply_synced_completions(request.user, pairs, today)
+    result["rejected"] = rejected
+
+    return JsonResponse(result)
 
+
+@login_required
+def export_history(request):
+    fmt = request.GET.get("format", "csv")
+    if fmt not in FORMATS:
+        return JsonResponse({"error": f"format must be one of {', '.join(FORMATS)}"}, status=400)
+
+    try:
+        start, end = (
+            date.fromisoformat(request.GET[key]) if request.GET.get(key) else None
+            for key in ("start", "end")
+        )
+    except ValueError:
+        return JsonResponse({"error": "start/end must be YYYY-MM-DD"}, status=400)
+
+    derived = request.GET.get("derived") == "1"
+
+    lines = export_lines(request.user.habits.all(), fmt, start, end, derived)
+    if isinstance(request, ASGIRequest):
+        # Otherwise Django buffers the whole export before sending it
+        lines = aexport_lines(lines)
+    response = StreamingHttpResponse(lines, content_type=FORMATS[fmt])
+    response["Content-Disposition"] = f'attachment; filename="habits-{request.user.username}.{fmt}"'
+    return response
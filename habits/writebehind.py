@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .completions import apply_queued_completions
+from .models import DEFAULT_DAILY_LOAD_CAP, CompletionEvent, Habit, UserProfile
+from .sharding import current_db, shard_aliases, use_shard, user_shard
+
+
+# With COMPLETION_WRITE_BEHIND, mark_complete only appends a
+# CompletionEvent on the user's shard and returns. flush_completions()
+# later applies the events in id order, so per habit in the order they
+# were tapped, and deletes them in the same transaction: after a crash
+# the unapplied ones are still queued and nothing is applied twice. A
+# user's own events are flushed before their dashboard is read.
+
+FLUSH_BATCH = 1000
+
+
+def enqueue_completion(user, habit_id, day):
+    # One read, so an unknown habit is still a 404, and one insert
+    with user_shard(user.pk):
+        if not Habit.objects.filter(pk=habit_id, user=user).exists():
+            raise Habit.DoesNotExist
+        CompletionEvent.objects.create(user=user, habit_id=habit_id, date=day)
+
+
+def flush_batch(batch_size=FLUSH_BATCH, user=None):
+    # Oldest events on the current shard, grouped per user. Returns how
+    # many were applied.
+    db = current_db()
+    with transaction.atomic(using=db):
+        events = CompletionEvent.objects.order_by("pk")
+        if user is not None:
+            events = events.filter(user=user)
+        events = list(events.values_list("pk", "user_id", "habit_id", "date")[:batch_size])
+        if not events:
+            return 0
+
+        pairs = {}
+        for _, user_id, habit_id, day in events:
+            pairs.setdefault(user_id, []).append((habit_id, day))
+
+        users = User.objects.in_bulk(pairs)
+        caps = dict(
+            UserProfile.objects
+            .filter(user_id__in=pairs)
+            .values_list("user_id", "daily_load_cap")
+        )
+        for user_id, user_pairs in pairs.items():
+            if user_id in users:
+                apply_queued_completions(users[user_id], user_pairs, caps.get(user_id, DEFAULT_DAILY_LOAD_CAP))
+
+        CompletionEvent.objects.filter(pk__in=[pk for pk, *_ in events]).delete()
+    return len(events)
+
+
+def flush_completions(batch_size=FLUSH_BATCH):
+    # Drains every shard
+    flushed = 0
+    for alias in shard_aliases():
+        with use_shard(alias):
+            while applied := flush_batch(batch_size):
+                flushed += applied
+    return flushed
+
+
+def last_queued(user):
+    # Id of the user's newest queued tap, or None; read-only
+    if not settings.COMPLETION_WRITE_BEHIND:
+        return None
+    with user_shard(user.pk):
+        return (
+            CompletionEvent.objects
+            .filter(user=user)
+            .order_by("-pk")
+            .values_list("pk", flat=True)
+            .first()
+        )
+
+
+def flush_user(user):
+    # Read-your-own-writes: one indexed lookup when nothing is queued
+    if not settings.COMPLETION_WRITE_BEHIND:
+        return
+    with user_shard(user.pk):
+        if CompletionEvent.objects.filter(user=user).exists():
+            while flush_batch(user=user):
+                pass